@@ -0,0 +1,301 @@
+"""Statistics over a region calculated while the response is downloaded, without building the full arrays
+
+Each line of the OpenDAP response is one row of longitudes, so the statistics are updated a row at a
+time with one pass algorithms and the memory used doesn't depend on the size of the region.
+"""
+import itertools
+import numpy as np
+from .getgfs import hyperslab_indices
+from .transport import stream, iter_lines
+from . import derived
+
+__copyright__ = """
+    getgfs - a library for extracting weather forecast variables from the NOAA GFS forecast in a pure python, no obscure dependencies way
+    Copyright (C) 2021 Jago Strong-Wright
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>."""
+
+
+class Digest:
+    """Approximate weighted quantiles from a fixed number of centroids"""
+
+    def __init__(self, size=200):
+        """Create empty digest
+
+        Args:
+            size (int, optional): Number of centroids to keep, more is more accurate. Defaults to 200.
+        """
+        self.size = size
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+
+    def update(self, values, weights):
+        """Add values to the digest
+
+        Args:
+            values (numpy array): Values to add
+            weights (numpy array): Weight of each value
+        """
+        self.means = np.concatenate([self.means, values])
+        self.weights = np.concatenate([self.weights, weights])
+        if len(self.means) > 2 * self.size:
+            self.compress()
+
+    def compress(self):
+        """Merges the centroids into size groups of equal weight"""
+        order = np.argsort(self.means)
+        means, weights = self.means[order], self.weights[order]
+        cumulative = np.cumsum(weights)
+        groups = np.minimum(
+            (cumulative - weights / 2) / cumulative[-1] * self.size, self.size - 1
+        ).astype(int)
+        totals = np.bincount(groups, weights, self.size)
+        keep = totals > 0
+        self.means = (
+            np.bincount(groups, weights * means, self.size)[keep] / totals[keep]
+        )
+        self.weights = totals[keep]
+
+    def quantile(self, q):
+        """Estimate a quantile
+
+        Args:
+            q (float): Quantile between 0 and 1
+
+        Returns:
+            float: Estimated value, nan if the digest is empty
+        """
+        if len(self.means) == 0:
+            return np.nan
+        order = np.argsort(self.means)
+        means, weights = self.means[order], self.weights[order]
+        cumulative = np.cumsum(weights) - weights / 2
+        return float(np.interp(q * weights.sum(), cumulative, means))
+
+
+class Accumulator:
+    """One pass weighted mean, standard deviation, minimum, maximum and quantiles"""
+
+    def __init__(self, percentiles=()):
+        """Create empty accumulator
+
+        Args:
+            percentiles (list, optional): Percentiles (0 to 100) to estimate. Defaults to ().
+        """
+        self.percentiles = percentiles
+        self.count = 0
+        self.weight = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.digest = Digest() if len(percentiles) > 0 else None
+
+    def update(self, values, weights):
+        """Add a batch of values, combined with the running statistics using Chan et al.'s parallel algorithm
+
+        Args:
+            values (numpy array): Values to add
+            weights (numpy array): Weight of each value
+        """
+        batch_weight = weights.sum()
+        if len(values) == 0 or batch_weight <= 0:
+            return
+        batch_mean = np.dot(weights, values) / batch_weight
+        batch_m2 = np.dot(weights, (values - batch_mean) ** 2)
+        total = self.weight + batch_weight
+        delta = batch_mean - self.mean
+        self.mean += delta * batch_weight / total
+        self.m2 += batch_m2 + delta**2 * self.weight * batch_weight / total
+        self.weight = total
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        if self.digest is not None:
+            self.digest.update(values, weights)
+
+    def result(self):
+        """The statistics so far
+
+        Returns:
+            dict: mean, std, min, max, count and a pXX entry for each percentile
+        """
+        empty = self.count == 0
+        stats = {
+            "mean": np.nan if empty else self.mean,
+            "std": np.nan if empty else np.sqrt(self.m2 / self.weight),
+            "min": np.nan if empty else self.min,
+            "max": np.nan if empty else self.max,
+            "count": self.count,
+        }
+        for p in self.percentiles:
+            stats["p%g" % p] = self.digest.quantile(p / 100)
+        return stats
+
+
+def polygon_mask(lat, lons, polygon):
+    """Finds which points along a line of latitude are inside a polygon (by ray casting)
+
+    Args:
+        lat (float): Latitude of the row
+        lons (numpy array): Longitudes of the points in the row
+        polygon (numpy array): (lat, lon) vertices of the polygon
+
+    Returns:
+        numpy array: True for the points inside
+    """
+    lats, plons = polygon[:, 0], polygon[:, 1]
+    # Put the points in the same 360 degree window as the polygon
+    lons = (lons - plons.min()) % 360 + plons.min()
+    next_lats, next_lons = np.roll(lats, -1), np.roll(plons, -1)
+    crosses = (lats > lat) != (next_lats > lat)
+    crossings = plons[crosses] + (lat - lats[crosses]) * (
+        next_lons[crosses] - plons[crosses]
+    ) / (next_lats[crosses] - lats[crosses])
+    return np.sum(lons[:, None] < crossings[None, :], axis=1) % 2 == 1
+
+
+def aggregate(
+    forecast,
+    variables,
+    date_time,
+    lat,
+    lon,
+    percentiles=(),
+    area_weighted=True,
+    polygon=None,
+    stride=None,
+    target_resolution=None,
+):
+    """Calculates statistics over a region for each variable and timestep (and level) as the data is downloaded
+
+    Args:
+        forecast (Forecast): Forecast to download from
+        variables (list): list of required variables by short name
+        date_time (string or tuple): datetime requested, or a (start, end) tuple for a range of timesteps
+        lat (string or number): latitude in the format "[min:max]" or a single value
+        lon (string or number): longitude in the format "[min:max]" or a single value
+        percentiles (list, optional): Percentiles (0 to 100) to estimate. Defaults to ().
+        area_weighted (bool, optional): Weight points by cos(latitude) so each represents its area. Defaults to True.
+        polygon (list, optional): (lat, lon) vertices of a polygon, only points inside it are used. Defaults to None.
+        stride (int or dict, optional): Take every nth point (see Forecast.get). Defaults to None.
+        target_resolution (float or dict, optional): Target resolution instead of a stride (see Forecast.get). Defaults to None.
+
+    Raises:
+        ValueError: Derived variables can't be aggregated
+        Exception: Unknown failure to download the file
+
+    Returns:
+        dict: For each variable a dict of numpy arrays over time (and level) of mean, std, min, max, count and pXX for each percentile,
+        with the time and lev coordinate values
+    """
+    for variable in variables:
+        if derived.is_derived(variable, forecast.variables):
+            raise ValueError(
+                "The derived variable {name} can not be aggregated, please aggregate the variables it is calculated from".format(
+                    name=variable
+                )
+            )
+
+    run = forecast.datetime_to_forecast(forecast.run_time(date_time))
+    request = forecast.prepare(
+        variables, date_time, lat, lon, run, stride, target_resolution
+    )
+    lats = float(forecast.coords["lat"]["minimum"]) + float(
+        forecast.coords["lat"]["resolution"]
+    ) * hyperslab_indices(request["lat"])
+    lons = float(forecast.coords["lon"]["minimum"]) + float(
+        forecast.coords["lon"]["resolution"]
+    ) * hyperslab_indices(request["lon"])
+    if area_weighted:
+        row_weights = np.cos(np.radians(lats))
+    else:
+        row_weights = np.ones(len(lats))
+    if polygon is not None:
+        polygon = np.array(polygon, dtype=float)
+
+    accumulators = {v: {} for v in request["variables"]}
+    shapes = {}
+    coords = {v: {} for v in request["variables"]}
+
+    url = forecast.query_url(
+        request["forecast_date"],
+        request["forecast_time"],
+        "ascii?{query}".format(query=request["query"]),
+    )
+    with stream(url) as r:
+        lines = iter_lines(r, url)
+        first = next(lines, "")
+        if r.status_code != 200 or first[:6] == "<html>":
+            forecast.response_to_file(
+                r.status_code,
+                "\n".join(itertools.chain([first], lines)),
+                request["forecast_date"],
+                request["forecast_time"],
+                request["time"],
+                request["lat"],
+                request["lon"],
+            )
+
+        current = None
+        last = None
+        coord = None
+        for line in itertools.chain([first], lines):
+            if len(line) == 0:
+                continue
+            if coord is not None:
+                # The values of a coordinate, only the small ones are kept
+                if coord in ["time", "lev"]:
+                    coords[last][coord] = [float(v) for v in line.split(",")]
+                coord = None
+            elif line[0] == "[":
+                if current is None:
+                    continue
+                split = line.index(",")
+                position = tuple(int(v) for v in line[1 : split - 1].split("]["))
+                values = np.array(line[split + 1 :].split(","), dtype=float)
+                weights = np.full(len(values), row_weights[position[-1]])
+                valid = ~np.isnan(values)
+                fill = forecast.variables[current].get("_FillValue")
+                if fill is not None:
+                    valid &= values != fill
+                if polygon is not None:
+                    valid &= polygon_mask(lats[position[-1]], lons, polygon)
+                if position[:-1] not in accumulators[current]:
+                    accumulators[current][position[:-1]] = Accumulator(percentiles)
+                accumulators[current][position[:-1]].update(
+                    values[valid], weights[valid]
+                )
+            else:
+                name = line[: line.index(",")]
+                if name in accumulators:
+                    current = last = name
+                    shapes[name] = tuple(
+                        int(d) for d in line[line.index("[") + 1 : -1].split("][")
+                    )[:-2]
+                else:
+                    current = None
+                    coord = name
+
+    results = {}
+    for name, by_position in accumulators.items():
+        stats = {}
+        for position, accumulator in by_position.items():
+            for stat, value in accumulator.result().items():
+                if stat not in stats:
+                    stats[stat] = np.full(shapes[name], np.nan)
+                stats[stat][position] = value
+        stats.update(coords[name])
+        results[name] = stats
+    return results
@@ -0,0 +1,268 @@
+"""Forecasts for asyncio programs, the requests are awaited rather than blocking so lots of queries can run on one event loop
+
+AsyncForecast works like Forecast (the urls, indices and decoding are shared with it) but the methods
+that make requests are coroutines. It needs aiohttp (`pip install aiohttp`)::
+
+    async with AsyncForecast("0p25") as f:
+        res = await f.get(["tmp2m"], "20210205 11pm", 51.5, 0)
+"""
+import asyncio
+from .getgfs import (
+    BaseForecast,
+    attribute_lock,
+    attribute_urls,
+    config_lock,
+    load_attributes,
+    parse_attributes,
+    previous_run,
+    record_attributes,
+    save_attributes,
+    windprofile_variables,
+)
+from .locking import FileLock
+from .transport import fetch_async
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+__copyright__ = """
+    getgfs - a library for extracting weather forecast variables from the NOAA GFS forecast in a pure python, no obscure dependencies way
+    Copyright (C) 2021 Jago Strong-Wright
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>."""
+
+
+class AsyncForecast(BaseForecast):
+    """Forecast with awaitable requests
+
+    Note
+    ----
+    The forecast's attributes are loaded by `load` (or entering it with `async with`), the coroutines
+    load them if that hasn't been done yet. Requests go through the same rate limiter as Forecast's.
+    Lazy variables and aggregation are only available from Forecast.
+    """
+
+    def __init__(self, resolution="0p25", timestep="", session=None):
+        """Setting up the forecast object by specifying the forecast type, nothing is downloaded until it is loaded
+
+        Args:
+            resolution (str, optional): The forecast resulution, choices are 1p00, 0p50 and 0p25. Defaults to "0p25".
+            timestep (str, optional): The timestep of the forecast to use, most do not have a choice but 0p25 can be 3hr (default) or 1hr. Defaults to "".
+            session (aiohttp.ClientSession, optional): Session to make the requests with, one is made (and closed by close) if None. Defaults to None.
+        """
+        BaseForecast.__init__(self, resolution, timestep)
+        self.session = session
+        self.own_session = session is None
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        """Creates and loads a forecast, the arguments are the same as AsyncForecast
+
+        Returns:
+            AsyncForecast: The loaded forecast
+        """
+        return await cls(*args, **kwargs).load()
+
+    async def load(self):
+        """Loads the forecast's variables and coordinates, downloading them if they haven't been saved
+
+        Note
+        ----
+        The saved attributes are shared with Forecast, see get_attributes
+
+        Raises:
+            Exception: Failed to download the requested resolution and forecast
+            RuntimeError: Failed to download the other attributes
+
+        Returns:
+            AsyncForecast: The forecast
+        """
+        if self.variables is not None:
+            return self
+        data = load_attributes(self.resolution, self.timestep)
+        if data is None:
+            lock = FileLock(
+                attribute_lock.format(res=self.resolution, step=self.timestep)
+            )
+            await lock.acquire_async()
+            try:
+                # Another process may have downloaded them while we were waiting for the lock
+                data = load_attributes(self.resolution, self.timestep)
+                if data is None:
+                    das, dds = await asyncio.gather(
+                        *[
+                            self.fetch(u)
+                            for u in attribute_urls(self.resolution, self.timestep)
+                        ]
+                    )
+                    data = save_attributes(
+                        self.resolution, self.timestep, *parse_attributes(das, dds)
+                    )
+                    config = FileLock(config_lock)
+                    await config.acquire_async()
+                    try:
+                        record_attributes(self.resolution, self.timestep)
+                    finally:
+                        config.release()
+            finally:
+                lock.release()
+        self.times, self.coords, self.variables = (
+            data["time"],
+            data["coords"],
+            data["variables"],
+        )
+        return self
+
+    async def fetch(self, url):
+        """Gets a url through the shared rate limiter
+
+        Args:
+            url (str): Address to get
+
+        Raises:
+            RuntimeError: aiohttp not installed
+
+        Returns:
+            Response: The response
+        """
+        if self.session is None:
+            if aiohttp is None:
+                raise RuntimeError(
+                    "You can not use AsyncForecast without aiohttp installed, please `pip install aiohttp`. Other functionality is still available"
+                )
+            self.session = aiohttp.ClientSession()
+        return await fetch_async(self.session, url)
+
+    async def close(self):
+        """Closes the session if it was made by the forecast"""
+        if self.own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.load()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def get(
+        self, variables, date_time, lat, lon, stride=None, target_resolution=None
+    ):
+        """Returns the latest forecast available for the requested date and time, see Forecast.get for the arguments
+
+        Returns:
+            File Object: File object with the downloaded variable data (see File documentation)
+        """
+        await self.load()
+        run = await self.datetime_to_forecast(self.run_time(date_time))
+        request = self.prepare(
+            variables, date_time, lat, lon, run, stride, target_resolution
+        )
+        r = await self.fetch(
+            self.query_url(
+                request["forecast_date"],
+                request["forecast_time"],
+                "ascii?{query}".format(query=request["query"]),
+            )
+        )
+        return self.decode_response(variables, request, r)
+
+    async def check_avail(self, forecast_date, forecast_time):
+        r = await self.fetch(
+            self.query_url(forecast_date, forecast_time, "ascii?gustsfc[0][540][1260]")
+        )
+        return r.text[:6] != "<html>"
+
+    async def run_available(self, forecast_date, forecast_time):
+        """Checks if a forecast run is available, remembering runs that have been found
+
+        Args:
+            forecast_date (string): Forecast date in the format YYYYMMDD
+            forecast_time (string): Forecast run hour
+
+        Returns:
+            bool: Whether the run is available
+        """
+        run = "%s%02d" % (forecast_date, int(forecast_time))
+        if run in self.available_runs:
+            return True
+        if await self.check_avail(forecast_date, forecast_time):
+            self.available_runs.add(run)
+            return True
+        return False
+
+    async def latest_run(self):
+        """Finds the most recent forecast run that is available
+
+        Raises:
+            ValueError: No run from the last week is available
+
+        Returns:
+            string: forecast date
+            string: forecast run
+        """
+        for forecast_date, forecast_time in self.recent_runs():
+            if await self.run_available(forecast_date, forecast_time):
+                return forecast_date, forecast_time
+        raise ValueError("No forecast run from the last week is available")
+
+    async def datetime_to_forecast(self, date_time):
+        """Works out which forecast date/run/time is required for the latest values for a chosen time, see Forecast.datetime_to_forecast
+
+        Note
+        ----
+        The availability of each distinct run is checked concurrently
+
+        Args:
+            date_time (string, datetime, numpy.datetime64 or array): The date and time of the desired forecast
+
+        Raises:
+            ValueError: The date time requested is not available from the NOAA at this time
+
+        Returns:
+            Same as Forecast.datetime_to_forecast
+        """
+        await self.load()
+        plan = self.plan_runs(date_time)
+
+        async def available(candidate):
+            while not await self.run_available(
+                candidate.strftime("%Y%m%d"), candidate.strftime("%H")
+            ):
+                candidate = previous_run(candidate, plan["earliest"])
+            return candidate
+
+        runs = await asyncio.gather(*[available(c) for c in plan["candidates"]])
+        return self.resolve_runs(plan, list(runs))
+
+    async def get_windprofile(self, date_time, lat, lon):
+        """Finds the verticle wind profile for a location, see Forecast.get_windprofile
+
+        Args:
+            date_time (string): datetime requested (parser used so any format fine)
+            lat (string or number): Latitude for data
+            lon (string or number): Longitude for data
+
+        Returns:
+            interpolation object: U component of wind interpolater by altitude
+            interpolation object: V component of wind interpolater by altitude
+        """
+        return self.interpolate_windprofile(
+            await self.get(windprofile_variables, date_time, lat, lon)
+        )
+
+    def __str__(self):
+        return "Asynchronous GFS forecast with resolution %s" % self.resolution
@@ -0,0 +1,326 @@
+"""Command line tool for bulk extraction of forecast variables described in a job file
+
+A job file is JSON in the format::
+
+    {
+        "resolution": "0p25",
+        "timestep": "1hr",
+        "output": "gfs_output",
+        "workers": 4,
+        "rate": 2,
+        "jobs": [
+            {
+                "name": "germany",
+                "variables": ["tmp2m", "ugrd10m", "vgrd10m"],
+                "times": {"start": "20210227 00:00", "end": "20210228 00:00"},
+                "lat": "[47:55]",
+                "lon": "[6:15]",
+                "target_resolution": 0.5
+            },
+            {
+                "name": "sites",
+                "variables": ["gustsfc"],
+                "times": ["20210227 06:00", "20210227 12:00"],
+                "points": [[51.5, -0.1], [55.9, -3.2]]
+            }
+        ]
+    }
+
+Each job is planned into tasks (one request each): a job with a list of times makes a task per time
+and a job with a start/end time range makes a single task covering the range. Jobs with points make a task
+per point. The top level "resolution" is the forecast grid, a job can be downsampled on the server with
+"stride" (every nth point) or "target_resolution" (in degrees, see Forecast.get). The results of each task
+are saved as a numpy .npz file in the output directory, and tasks that already have an output file are
+skipped so an interrupted job can be resumed by running it again. Task ids end with a hash of what the
+task downloads, so editing a job makes new tasks rather than reusing outputs for the old ones.
+"""
+import argparse, hashlib, json, os, re, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from .getgfs import Forecast
+from . import transport
+
+__copyright__ = """
+    getgfs - a library for extracting weather forecast variables from the NOAA GFS forecast in a pure python, no obscure dependencies way
+    Copyright (C) 2021 Jago Strong-Wright
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>."""
+
+
+def plan_tasks(jobs, grid="0p25"):
+    """Splits the jobs from a job file into individual requests
+
+    Args:
+        jobs (list): Jobs from the job file
+        grid (str, optional): The forecast resolution and timestep (see job_grid), part of each task's hash. Defaults to "0p25".
+
+    Raises:
+        ValueError: A job is missing required information
+
+    Returns:
+        list: Tasks as dicts with an id and the arguments for Forecast.get
+    """
+    tasks = []
+    for n, job in enumerate(jobs):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", str(job.get("name", "job%s" % n)))
+        if "variables" not in job or "times" not in job:
+            raise ValueError("Job %s must have variables and times" % name)
+        if "resolution" in job:
+            raise ValueError(
+                'Job %s has a "resolution", the forecast resolution can only be set for the whole file and jobs are downsampled with "target_resolution" (in degrees)'
+                % name
+            )
+
+        if isinstance(job["times"], dict):
+            times = [(job["times"]["start"], job["times"]["end"])]
+        elif isinstance(job["times"], str):
+            times = [job["times"]]
+        else:
+            times = job["times"]
+
+        if "points" in job:
+            positions = [(lat, lon) for lat, lon in job["points"]]
+        elif "lat" in job and "lon" in job:
+            positions = [(job["lat"], job["lon"])]
+        else:
+            raise ValueError("Job %s must have either points or lat and lon" % name)
+
+        for t_ind, date_time in enumerate(times):
+            for p_ind, (lat, lon) in enumerate(positions):
+                task = {
+                    "variables": list(job["variables"]),
+                    "date_time": date_time,
+                    "lat": lat,
+                    "lon": lon,
+                    "stride": job.get("stride"),
+                    "target_resolution": job.get("target_resolution"),
+                }
+                digest = hashlib.sha1(
+                    json.dumps([grid, task], sort_keys=True, default=str).encode()
+                ).hexdigest()[:10]
+                task["id"] = "%s-t%04d-p%04d-%s" % (name, t_ind, p_ind, digest)
+                tasks.append(task)
+    return tasks
+
+
+def job_grid(config):
+    """The forecast a job file downloads from, as it is named by NOMADS
+
+    Args:
+        config (dict): Loaded job file
+
+    Returns:
+        str: Resolution and timestep, e.g. 0p25 or 0p25_1hr
+    """
+    grid = config.get("resolution", "0p25")
+    if config.get("timestep", "") != "":
+        grid += "_" + config["timestep"]
+    return grid
+
+
+def run_task(forecast, task, output):
+    """Downloads a task and saves the result
+
+    Args:
+        forecast (Forecast): Forecast to download from
+        task (dict): Task from plan_tasks
+        output (str): Output directory
+
+    Returns:
+        int: Number of values downloaded
+        int: Number of bytes transferred
+    """
+    res = forecast.get(
+        task["variables"],
+        task["date_time"],
+        task["lat"],
+        task["lon"],
+        stride=task["stride"],
+        target_resolution=task["target_resolution"],
+    )
+    arrays = {}
+    values = 0
+    for name, variable in res.variables.items():
+        arrays[name] = variable.data
+        values += variable.data.size
+        for coord_name, coord in variable.coords.items():
+            arrays["%s_%s" % (name, coord_name)] = np.array(coord.values)
+
+    # Written to a temporary file first so an interrupted task never looks complete
+    fd, temp = tempfile.mkstemp(suffix=".npz", dir=output)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(temp, task_path(output, task))
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    return values, res.transfer.compressed
+
+
+def task_path(output, task):
+    """Path of the output file for a task
+
+    Args:
+        output (str): Output directory
+        task (dict): Task from plan_tasks
+
+    Returns:
+        str: Path to the .npz file
+    """
+    return os.path.join(output, "%s.npz" % task["id"])
+
+
+class Progress:
+    """Thread safe progress and throughput display"""
+
+    def __init__(self, total, stream=sys.stderr):
+        """Start tracking progress
+
+        Args:
+            total (int): Number of tasks to run
+            stream (file, optional): Where to write progress. Defaults to sys.stderr.
+        """
+        self.total = total
+        self.stream = stream
+        self.done = 0
+        self.failed = 0
+        self.values = 0
+        self.bytes = 0
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self, values=0, transferred=0, failed=False):
+        """Record a finished task and redraw the progress line
+
+        Args:
+            values (int, optional): Number of values downloaded by the task. Defaults to 0.
+            transferred (int, optional): Number of bytes transferred by the task. Defaults to 0.
+            failed (bool, optional): Whether the task failed. Defaults to False.
+        """
+        with self.lock:
+            self.done += 1
+            self.failed += int(failed)
+            self.values += values
+            self.bytes += transferred
+            elapsed = max(time.monotonic() - self.start, 1e-9)
+            rate = self.done / elapsed
+            eta = (self.total - self.done) / rate if rate > 0 else 0
+            self.stream.write(
+                "\r[{done}/{total}] {failed} failed, {rate:.2f} tasks/s, {vrate:.0f} values/s, {brate:.1f} kB/s, eta {eta:.0f}s".format(
+                    done=self.done,
+                    total=self.total,
+                    failed=self.failed,
+                    rate=rate,
+                    vrate=self.values / elapsed,
+                    brate=self.bytes / elapsed / 1000,
+                    eta=eta,
+                )
+            )
+            self.stream.flush()
+
+
+def run_jobs(config, output=None, workers=None, resume=True, stream=sys.stderr):
+    """Plans and runs all the tasks in a job file
+
+    Args:
+        config (dict): Loaded job file
+        output (str, optional): Output directory, overrides the job file. Defaults to None.
+        workers (int, optional): Number of parallel requests (also the cap on requests in flight), overrides the job file. Defaults to None.
+        resume (bool, optional): Skip tasks that already have an output file. Defaults to True.
+        stream (file, optional): Where to write progress. Defaults to sys.stderr.
+
+    Returns:
+        dict: Errors by task id for any failed tasks
+    """
+    output = output or config.get("output", "gfs_output")
+    workers = workers or int(config.get("workers", 4))
+    transport.configure(
+        rate=float(config.get("rate", 2)),
+        max_in_flight=workers,
+        lock_file=config.get("lock_file"),
+    )
+    os.makedirs(output, exist_ok=True)
+
+    tasks = plan_tasks(config["jobs"], job_grid(config))
+    if resume:
+        skipped = [t for t in tasks if os.path.isfile(task_path(output, t))]
+        tasks = [t for t in tasks if not os.path.isfile(task_path(output, t))]
+        if len(skipped) > 0:
+            stream.write("Skipping %s completed tasks\n" % len(skipped))
+    if len(tasks) == 0:
+        return {}
+
+    forecast = Forecast(config.get("resolution", "0p25"), config.get("timestep", ""))
+    progress = Progress(len(tasks), stream)
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_task, forecast, t, output): t for t in tasks}
+        for future in as_completed(futures):
+            try:
+                progress.update(*future.result())
+            except Exception as e:
+                errors[futures[future]["id"]] = e
+                progress.update(failed=True)
+    stream.write("\n")
+    return errors
+
+
+def main(argv=None):
+    """Entry point for the getgfs command
+
+    Args:
+        argv (list, optional): Command line arguments. Defaults to None (sys.argv).
+
+    Returns:
+        int: Exit code
+    """
+    parser = argparse.ArgumentParser(
+        prog="getgfs", description="Bulk extract GFS forecast variables from a job file"
+    )
+    parser.add_argument("job_file", help="JSON job file describing what to download")
+    parser.add_argument("-o", "--output", help="output directory")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="number of requests to run in parallel, also the cap on requests in flight at once (default 4 or the job file's workers)",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="download every task even if it already has an output file",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="list the planned tasks and exit"
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.job_file) as f:
+        config = json.load(f)
+
+    if args.dry_run:
+        for task in plan_tasks(config["jobs"], job_grid(config)):
+            print("{id}: {variables} {date_time} lat={lat} lon={lon}".format(**task))
+        return 0
+
+    errors = run_jobs(config, args.output, args.workers, not args.no_resume)
+    for task_id, error in errors.items():
+        sys.stderr.write("%s failed: %s\n" % (task_id, error))
+    return 1 if len(errors) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
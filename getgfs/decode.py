@@ -77,7 +77,7 @@ class File:
                     name_line = False
                 else:
                     coords.append(
-                        Coordinate(name, [float(v[:-1]) for v in line.split()])
+                        Coordinate(name, [float(v.rstrip(",")) for v in line.split()])
                     )
                     name_line = True
 
@@ -0,0 +1,237 @@
+"""Variables that aren't in the forecast but can be calculated from ones that are (e.g. wind speed)
+
+Derived variables can be requested by name in `Forecast.get` like any other variable. The variables they
+depend on are all downloaded in the same request (once, even if several derived variables need them) and
+the results are calculated afterwards, so they don't cost any extra requests. New ones can be added with
+the `register` decorator::
+
+    @register("tmp2m_c", ["tmp2m"], "2 m above ground temperature [c]")
+    def celsius(tmp2m):
+        return tmp2m - 273.15
+"""
+import numpy as np
+from .decode import Variable
+
+__copyright__ = """
+    getgfs - a library for extracting weather forecast variables from the NOAA GFS forecast in a pure python, no obscure dependencies way
+    Copyright (C) 2021 Jago Strong-Wright
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>."""
+
+registry = {}
+
+
+class DerivedVariable:
+    """Describes how to calculate a variable from others"""
+
+    def __init__(self, name, requires, function, long_name=""):
+        """Create derived variable
+
+        Args:
+            name (string): Short name of the derived variable
+            requires (list): Short names of the variables (forecast or derived) it is calculated from
+            function (function): Takes the data of the required variables as numpy arrays in the same order and returns the data
+            long_name (str, optional): Description of the variable. Defaults to "".
+        """
+        self.name = name
+        self.requires = list(requires)
+        self.function = function
+        self.long_name = long_name
+
+    def __str__(self):
+        return self.name
+
+
+def register(name, requires, long_name=""):
+    """Decorator to add a function to the registry as a derived variable
+
+    Args:
+        name (string): Short name of the derived variable
+        requires (list): Short names of the variables it is calculated from
+        long_name (str, optional): Description of the variable. Defaults to "".
+
+    Returns:
+        function: Decorator
+    """
+
+    def decorator(function):
+        registry[name] = DerivedVariable(name, requires, function, long_name)
+        return function
+
+    return decorator
+
+
+def is_derived(name, available):
+    """Checks if a name refers to a derived variable rather than a forecast variable
+
+    Args:
+        name (string): Short name
+        available (dict): The forecast's variables
+
+    Returns:
+        bool: True if the variable must be calculated
+    """
+    return name not in available and name in registry
+
+
+def resolve(names, available):
+    """Finds the forecast variables needed to get the requested variables
+
+    Args:
+        names (list): Requested short names, forecast or derived
+        available (dict): The forecast's variables
+
+    Raises:
+        ValueError: Derived variables depend on each other in a loop
+
+    Returns:
+        list: Forecast variables to download, each only once and in the order first needed
+    """
+    base = []
+
+    def visit(name, path):
+        if not is_derived(name, available):
+            if name not in base:
+                base.append(name)
+            return
+        if name in path:
+            raise ValueError(
+                "The derived variable {name} depends on itself".format(name=name)
+            )
+        for requirement in registry[name].requires:
+            visit(requirement, path + [name])
+
+    for name in names:
+        visit(name, [])
+    return base
+
+
+def compute(names, variables, available):
+    """Calculates derived variables from downloaded ones
+
+    Note
+    ----
+    Fill values in the downloaded data are replaced with nan before calculating, forecast variables
+    that were requested themselves are returned as they were downloaded
+
+    Args:
+        names (list): Requested short names, forecast or derived
+        variables (dict): Downloaded Variable objects by name
+        available (dict): The forecast's variables (for the fill values)
+
+    Returns:
+        dict: Variable objects for each of the requested names
+    """
+    memo = {}
+
+    def evaluate(name):
+        if name not in memo:
+            if is_derived(name, available):
+                derived = registry[name]
+                inputs = [evaluate(requirement) for requirement in derived.requires]
+                memo[name] = Variable(
+                    name,
+                    inputs[0].coords,
+                    derived.function(*[v.data for v in inputs]),
+                )
+            else:
+                variable = variables[name]
+                fill = available[name].get("_FillValue")
+                data = variable.data
+                if fill is not None:
+                    data = np.where(data == fill, np.nan, data)
+                memo[name] = Variable(name, variable.coords, data)
+        return memo[name]
+
+    return {
+        name: evaluate(name) if is_derived(name, available) else variables[name]
+        for name in names
+    }
+
+
+def speed(u, v):
+    """Magnitude of a vector from its components
+
+    Args:
+        u (numpy array): Eastward component
+        v (numpy array): Northward component
+
+    Returns:
+        numpy array: Magnitude
+    """
+    return np.hypot(u, v)
+
+
+def direction(u, v):
+    """Meteorological direction (the direction the wind is coming from, clockwise from north)
+
+    Args:
+        u (numpy array): Eastward component
+        v (numpy array): Northward component
+
+    Returns:
+        numpy array: Direction in degrees
+    """
+    return np.mod(180 + np.degrees(np.arctan2(u, v)), 360)
+
+
+for level, description in [
+    ("10m", "10 m above ground"),
+    ("20m", "20 m above ground"),
+    ("30m", "30 m above ground"),
+    ("40m", "40 m above ground"),
+    ("50m", "50 m above ground"),
+    ("80m", "80 m above ground"),
+    ("100m", "100 m above ground"),
+    ("_1829m", "1829 m above mean sea level"),
+    ("_2743m", "2743 m above mean sea level"),
+    ("_3658m", "3658 m above mean sea level"),
+    ("prs", "(1000 975 950 925 900.. 7 5 3 2 1)"),
+    ("sig995", "0.995 sigma level"),
+    ("pbl", "planetary boundary layer"),
+    ("mwl", "max wind"),
+    ("trop", "tropopause"),
+]:
+    register(
+        "wspd" + level,
+        ["ugrd" + level, "vgrd" + level],
+        "** %s wind speed [m/s] " % description,
+    )(speed)
+    register(
+        "wdir" + level,
+        ["ugrd" + level, "vgrd" + level],
+        "** %s wind direction (from) [deg] " % description,
+    )(direction)
+
+
+@register(
+    "dptdep2m", ["tmp2m", "dpt2m"], "** 2 m above ground dew point depression [k] "
+)
+def dew_point_depression(tmp, dpt):
+    """Difference between the temperature and dew point"""
+    return tmp - dpt
+
+
+@register("rho80m", ["pres80m", "tmp80m"], "** 80 m above ground air density [kg/m^3] ")
+def air_density(pres, tmp):
+    """Dry air density from the ideal gas law"""
+    return pres / (287.05 * tmp)
+
+
+@register(
+    "wpd80m", ["wspd80m", "rho80m"], "** 80 m above ground wind power density [w/m^2] "
+)
+def wind_power_density(wspd, rho):
+    """Kinetic energy flux of the wind per unit area"""
+    return 0.5 * rho * wspd**3
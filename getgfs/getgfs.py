@@ -1,10 +1,13 @@
 """getgfs - a library for extracting weather forecast variables from the NOAA GFS forecast in a pure python, no obscure dependencies way
 """
-import requests, json, os, re, dateutil.parser, sys, warnings
-from datetime import datetime, timedelta
+import json, os, re, dateutil.parser, sys, warnings
+from datetime import datetime, timedelta, timezone
 import numpy as np
 from scipy.interpolate import interp1d
 from .decode import *
+from .transport import fetch
+from .locking import FileLock, atomic_write
+from . import derived
 
 try:
     with warnings.catch_warnings():
@@ -37,81 +40,122 @@ url = "https://nomads.ncep.noaa.gov/dods/gfs_{res}{step}/gfs{date}/gfs_{res}{ste
 config_file = "%s/config.json" % route
 attribute_file = "%s/atts/{res}{step}.json" % route
 
-if not os.path.isdir("%s/atts" % route):
-    os.makedirs("%s/atts" % route)
+config_lock = "%s/config.lock" % route
+attribute_lock = "%s/atts/{res}{step}.lock" % route
+
+os.makedirs("%s/atts" % route, exist_ok=True)
 if not os.path.isfile(config_file):
-    with open(config_file, "w+") as f:
-        json.dump({"saved_atts": ["Na"]}, f)
+    with FileLock(config_lock):
+        if not os.path.isfile(config_file):
+            atomic_write(config_file, json.dumps({"saved_atts": ["Na"]}))
 
+windprofile_variables = ["ugrdprs", "vgrdprs", "ugrd10m", "vgrd10m", "hgtsfc", "hgtprs"]
 
-class Forecast:
-    """Object that can be manipulated to get forecast information"""
+
+class BaseForecast:
+    """The parts of a forecast that don't make any requests, shared by Forecast and the asyncio AsyncForecast"""
 
     def __init__(self, resolution="0p25", timestep=""):
-        """Setting up the forecast object by specifying the forecast type
+        """Checks the forecast type, the attributes are loaded by the subclasses
 
         Args:
             resolution (str, optional): The forecast resulution, choices are 1p00, 0p50 and 0p25. Defaults to "0p25".
             timestep (str, optional): The timestep of the forecast to use, most do not have a choice but 0p25 can be 3hr (default) or 1hr. Defaults to "".
         """
-        if timestep != "":
-            timestep = "_" + timestep
-
-        if resolution not in ["1p00", "0p50", "0p25"]:
-            raise ValueError(
-                "You have entered an invalid forecast resulution, the choices are 1p00, 0p50 and 0p25. You entered %s"
-                % resolution
-            )
-        if (timestep != "" and resolution != "0p25") or (
-            timestep not in ["_1hr", ""] and resolution == "0p25"
-        ):
-            raise ValueError(
-                "You have entered an invalid forecast timestep, the only choice is 1hr for 0p25 forecasts or the default. You entered %s"
-                % timestep
-            )
         self.resolution = resolution
-        self.timestep = timestep
-        self.times, self.coords, self.variables = get_attributes(resolution, timestep)
+        self.timestep = check_forecast(resolution, timestep)
+        self.times, self.coords, self.variables = None, None, None
+        self.available_runs = set()
 
-    def get(self, variables, date_time, lat, lon):
-        """Returns the latest forecast available for the requested date and time
+    def decode_response(self, variables, request, r):
+        """Decodes the response to a request made by prepare, calculating any derived variables
 
-        Note
-        ----
-        - "raw" since you have to put indexes in rather than coordinates and it returns a file object rather than a processed file
-        - If a variable has level dependance, you get all the levels - it seems extremely hard to impliment otherwise
+        Args:
+            variables (list): list of variables requested, including derived variables
+            request (dict): Request from prepare
+            r (Response): Response to the request's query
+
+        Raises:
+            Exception: Unknown failure to download the file
+
+        Returns:
+            File Object: File object with the downloaded variable data, transfer has the size of the response
+        """
+        res = self.response_to_file(
+            r.status_code,
+            r.text,
+            request["forecast_date"],
+            request["forecast_time"],
+            request["time"],
+            request["lat"],
+            request["lon"],
+        )
+        res.transfer = r.transfer
+        if request["variables"] != list(variables):
+            res.variables = derived.compute(variables, res.variables, self.variables)
+        return res
+
+    def prepare(
+        self,
+        variables,
+        date_time,
+        lat,
+        lon,
+        run,
+        stride=None,
+        target_resolution=None,
+    ):
+        """Works out the OpenDAP query for a request, the other arguments are the same as get
 
         Args:
-            variables (list): list of required variables by short name
-            date_time (string): datetime requested (parser used so any format fine)
+            variables (list): list of required variables by short name, including derived variables (see getgfs.derived)
+            date_time (string or tuple): datetime requested, or a (start, end) tuple for a range of timesteps
             lat (string or number): latitude in the format "[min:max]" or a single value
             lon (string or number): longitude in the format "[min:max]" or a single value
+            run (tuple): The result of datetime_to_forecast for run_time(date_time)
+            stride (int or dict, optional): Take every nth point. Defaults to None.
+            target_resolution (float or dict, optional): Target resolution instead of a stride. Defaults to None.
 
         Raises:
+            ValueError: Invalid range of datetimes or the range goes past the end of the forecast run
             ValueError: Invalid variable choice
             ValueError: Level dependance needs to be specified for chosen variable
-            Exception: Unknown failure to download the file
 
         Returns:
-            File Object: File object with the downloaded variable data (see File documentation)
+            dict: The forecast date and run, the hyperslab for each coordinate (time, lev, lat, lon), the forecast variables to download and the query
         """
-
         # Get forecast date run, date, time
-        forecast_date, forecast_time, query_time = self.datetime_to_forecast(date_time)
+        self.run_time(date_time)
+        forecast_date, forecast_time, query_time = run
+        if isinstance(date_time, tuple):
+            query_time = index_range(
+                int(query_time[1:-1]),
+                self.time_to_index(forecast_date, forecast_time, date_time[1]),
+                self.coord_stride("time", stride, target_resolution),
+            )
 
         # Get latitude
-        lat = self.value_input_to_index("lat", lat)
+        lat = self.value_input_to_index(
+            "lat", lat, self.coord_stride("lat", stride, target_resolution)
+        )
 
         # Get longitude
-        lon = self.value_input_to_index("lon", lon)
+        lon = self.value_input_to_index(
+            "lon", lon, self.coord_stride("lon", stride, target_resolution)
+        )
 
         # Get lev
-        lev = "[0:%s]" % int(
-            (self.coords["lev"]["minimum"] - self.coords["lev"]["maximum"])
-            / self.coords["lev"]["resolution"]
+        lev = index_range(
+            0,
+            int(
+                (self.coords["lev"]["minimum"] - self.coords["lev"]["maximum"])
+                / self.coords["lev"]["resolution"]
+            ),
+            self.coord_stride("lev", stride, target_resolution),
         )
 
-        # Make query
+        # Make query, derived variables are swapped for the forecast variables they are calculated from
+        variables = derived.resolve(variables, self.variables)
         query = ""
         for variable in variables:
             if variable not in self.variables.keys():
@@ -133,16 +177,89 @@ class Forecast:
 
         query = query[1:]
 
-        r = requests.get(
-            url.format(
-                res=self.resolution,
-                step=self.timestep,
-                date=forecast_date,
-                hour=int(forecast_time),
-                info="ascii?{query}".format(query=query),
+        return {
+            "forecast_date": forecast_date,
+            "forecast_time": forecast_time,
+            "time": query_time,
+            "lev": lev,
+            "lat": lat,
+            "lon": lon,
+            "variables": variables,
+            "query": query,
+        }
+
+    def run_time(self, date_time):
+        """The datetime whose forecast run is used for a request, to pass to datetime_to_forecast before prepare
+
+        Args:
+            date_time (string or tuple): datetime requested, or a (start, end) tuple for a range of timesteps
+
+        Raises:
+            ValueError: A list or array of datetimes (only datetime_to_forecast takes those)
+            ValueError: The range doesn't have a start and an end or ends before it starts
+
+        Returns:
+            string or datetime: The datetime requested or the start of the range
+        """
+        if not isinstance(date_time, tuple):
+            if np.ndim(date_time) != 0:
+                raise ValueError(
+                    "Requests are for one datetime or a (start, end) tuple, use datetime_to_forecast for lists or arrays of datetimes"
+                )
+            return date_time
+        if len(date_time) != 2:
+            raise ValueError(
+                "A range of datetimes must be a (start, end) tuple, you entered %s"
+                % (date_time,)
             )
+        if to_datetime64(date_time[0]) > to_datetime64(date_time[1]):
+            raise ValueError(
+                "The range of datetimes ends ({end}) before it starts ({start})".format(
+                    start=date_time[0], end=date_time[1]
+                )
+            )
+        return date_time[0]
+
+    def query_url(self, forecast_date, forecast_time, info):
+        """Makes the address for a request to this forecast
+
+        Args:
+            forecast_date (string): Forecast date in the format YYYYMMDD
+            forecast_time (string): Forecast run hour
+            info (string): What to request, e.g. das, dds or ascii?{query}
+
+        Returns:
+            str: url
+        """
+        return url.format(
+            res=self.resolution,
+            step=self.timestep,
+            date=forecast_date,
+            hour=int(forecast_time),
+            info=info,
         )
-        if r.status_code != 200:
+
+    def response_to_file(
+        self, status_code, text, forecast_date, forecast_time, query_time, lat, lon
+    ):
+        """Checks the response to a data request and decodes it
+
+        Args:
+            status_code (int): HTTP status of the response
+            text (string): Body of the response
+            forecast_date (string): Forecast date requested (for the error message)
+            forecast_time (string): Forecast run requested (for the error message)
+            query_time (string): Time index requested (for the error message)
+            lat (string): Latitude index requested (for the error message)
+            lon (string): Longitude index requested (for the error message)
+
+        Raises:
+            Exception: Unknown failure to download the file
+
+        Returns:
+            File Object: File object with the downloaded variable data (see File documentation)
+        """
+        if status_code != 200:
             raise Exception(
                 """The forecast information could not be downloaded. 
         This error should never occure but it may be helpful to know the requested information was:
@@ -158,7 +275,7 @@ class Forecast:
                     lon=lon,
                 )
             )
-        elif r.text[:6] == "<html>":
+        elif text[:6] == "<html>":
             raise Exception(
                 """The forecast information could not be downloaded. 
         This error should never occure but it may be helpful to know the requested information was:
@@ -178,98 +295,202 @@ class Forecast:
                     lon=lon,
                     res=re.findall(
                         """(<h2>GrADS Data Server - error<\/h2>)((.|\n)*)(Check the syntax of your request, or click <a href=".help">here<\/a> for help using the server.)""",
-                        r.text,
+                        text,
                     ),
                 )
             )
         else:
-            return File(r.text)
+            return File(text)
 
-    def check_avail(self, forecast_date, forecast_time):
-        r = requests.get(
-            url.format(
-                res=self.resolution,
-                step=self.timestep,
-                date=forecast_date,
-                hour=int(forecast_time),
-                info="ascii?gustsfc[0][540][1260]",
-            )
+    def recent_runs(self):
+        """The runs from the last week that could be available, most recent first
+
+        Returns:
+            list: (forecast date, forecast run) for each run
+        """
+        now = datetime.utcnow()
+        query_forecast = now.replace(
+            hour=6 * (now.hour // 6), minute=0, second=0, microsecond=0
         )
-        if r.text[:6] == "<html>":
-            return False
-        else:
-            return True
+        runs = []
+        while query_forecast > now - timedelta(days=7):
+            runs.append(
+                (query_forecast.strftime("%Y%m%d"), query_forecast.strftime("%H"))
+            )
+            query_forecast -= timedelta(hours=6)
+        return runs
 
-    def datetime_to_forecast(self, date_time):
-        """Works out which forecast date/run/time is required for the latest values for a chosen time
+    def plan_runs(self, date_time):
+        """Checks datetimes are in range and finds the latest run that could cover each one, for datetime_to_forecast
 
         Args:
-            date_time (string): The date and time of the desired forecast, parser is used so any format is valid e.g. 20210205 11pm
+            date_time (string, datetime, numpy.datetime64 or array): The date and time of the desired forecast
 
         Raises:
             ValueError: The date time requested is not available from the NOAA at this time
 
         Returns:
-            string: forecast date
-            string: forecast run
-            string: forecast query time (the appropriate timestep within the forecast)
+            dict: The distinct candidate runs (datetimes) to check, and what resolve_runs needs to map them back to the datetimes
         """
-        earliest_available = hour_round(datetime.utcnow() - timedelta(days=7))
-        latest_available = hour_round(
-            datetime.utcnow()
-            - timedelta(
-                hours=datetime.utcnow().hour
-                - 6 * (datetime.utcnow().hour // 6)
-                - int(self.times["grads_size"]) * int(self.times["grads_step"][0]),
-                minutes=datetime.utcnow().minute,
-                seconds=datetime.utcnow().second,
-                microseconds=datetime.utcnow().microsecond,
-            )
+        scalar = np.ndim(date_time) == 0
+        desired = to_datetime64(date_time).reshape(-1)
+
+        now = datetime.utcnow()
+        step = np.timedelta64(int(self.times["grads_step"][0]), "h")
+        latest_forecast = np.datetime64(
+            now.replace(hour=6 * (now.hour // 6), minute=0, second=0, microsecond=0),
+            "s",
         )
-        desired_date = dateutil.parser.parse(date_time)
-        latest_forecast = latest_available - timedelta(
-            hours=int(self.times["grads_size"]) * int(self.times["grads_step"][0])
-        )
-        if earliest_available < desired_date < latest_available:
-            query_forecast = latest_forecast
-            while desired_date < query_forecast:
-                query_forecast -= timedelta(hours=6)
-
-            forecast_date = query_forecast.strftime("%Y%m%d")
-            forecast_time = query_forecast.strftime("%H")
-
-            while not self.check_avail(forecast_date, forecast_time):
-                query_forecast -= timedelta(hours=6)
-                forecast_date = query_forecast.strftime("%Y%m%d")
-                forecast_time = query_forecast.strftime("%H")
-
-            query_time = "[{t_ind}]".format(
-                t_ind=round(
-                    (desired_date - query_forecast).total_seconds()
-                    / (int(self.times["grads_step"][0]) * 60 * 60)
-                )
-            )
+        latest_available = latest_forecast + int(self.times["grads_size"]) * step
+        earliest_available = np.datetime64(hour_round(now - timedelta(days=7)), "s")
 
-        else:
+        valid = (earliest_available < desired) & (desired < latest_available)
+        if not np.all(valid):
             raise ValueError(
                 "Datetime requested ({dt}) is not available the moment, usually only the last weeks worth of forecasts are available and this model only extends {hours} hours forward.\nThis error may be caused by an uninterpretable datetime format.".format(
                     hours=int(self.times["grads_size"])
                     * int(self.times["grads_step"][0]),
-                    dt=dateutil.parser.parse(date_time),
+                    dt=desired[~valid][0],
                 )
             )
 
-        return forecast_date, forecast_time, query_time
+        # The latest run at or before each time, which is then stepped back to one that is available
+        six_hours = np.timedelta64(6, "h")
+        epoch = np.datetime64("1970-01-01T00:00:00")
+        candidates = np.minimum(
+            latest_forecast, epoch + (desired - epoch) // six_hours * six_hours
+        )
+        unique, inverse = np.unique(candidates, return_inverse=True)
+        return {
+            "scalar": scalar,
+            "desired": desired,
+            "step": step,
+            "earliest": earliest_available.item(),
+            "candidates": unique.tolist(),
+            "inverse": inverse.reshape(-1),
+        }
+
+    def resolve_runs(self, plan, runs):
+        """Finishes datetime_to_forecast once the available run for each candidate is known
 
-    def value_input_to_index(self, coord, inpt):
+        Args:
+            plan (dict): Result of plan_runs
+            runs (list): The available run (datetime) for each of the plan's candidates
+
+        Returns:
+            Same as datetime_to_forecast
+        """
+        inverse = plan["inverse"]
+        indices = np.round(
+            (plan["desired"] - np.array(runs, dtype="datetime64[s]")[inverse])
+            / plan["step"]
+        ).astype(int)
+        forecast_date = np.array([run.strftime("%Y%m%d") for run in runs])[inverse]
+        forecast_time = np.array([run.strftime("%H") for run in runs])[inverse]
+
+        if plan["scalar"]:
+            return (
+                str(forecast_date[0]),
+                str(forecast_time[0]),
+                "[{t_ind}]".format(t_ind=indices[0]),
+            )
+        return forecast_date, forecast_time, indices
+
+    def time_to_index(self, forecast_date, forecast_time, date_time):
+        """Works out the timestep index of a datetime within a given forecast run
+
+        Args:
+            forecast_date (string): Forecast date in the format YYYYMMDD
+            forecast_time (string): Forecast run hour
+            date_time (string or datetime): The date and time wanted, parser is used for strings so any format is valid
+
+        Raises:
+            ValueError: The datetime is outside the forecast run
+
+        Returns:
+            int: Index of the closest timestep
+        """
+        run = datetime.strptime(
+            "%s%02d" % (forecast_date, int(forecast_time)), "%Y%m%d%H"
+        )
+        ind = round(
+            (to_datetime64(date_time).item() - run).total_seconds()
+            / (int(self.times["grads_step"][0]) * 60 * 60)
+        )
+        if not 0 <= ind < int(self.times["grads_size"]):
+            raise ValueError(
+                "Datetime requested ({dt}) is outside the {hour}z {date} forecast, which extends {hours} hours forward".format(
+                    dt=date_time,
+                    hour=forecast_time,
+                    date=forecast_date,
+                    hours=(int(self.times["grads_size"]) - 1)
+                    * int(self.times["grads_step"][0]),
+                )
+            )
+        return ind
+
+    def coord_stride(self, coord, stride=None, target_resolution=None):
+        """Works out the index stride for a coordinate from a stride or target resolution
+
+        Args:
+            coord (string): The short name of the coordinate (lat, lon, lev or time)
+            stride (int or dict, optional): Stride for lat and lon if an int, or by coordinate name if a dict. Defaults to None.
+            target_resolution (float or dict, optional): Target resolution for lat and lon if a number, or by coordinate name if a dict. Takes precedence over stride. Defaults to None.
+
+        Raises:
+            ValueError: Stride or target resolution is not positive
+
+        Returns:
+            int: Stride to use in the request (1 for every point)
+        """
+        if isinstance(target_resolution, dict):
+            target_resolution = target_resolution.get(coord)
+        elif coord not in ["lat", "lon"]:
+            target_resolution = None
+        if target_resolution is not None:
+            if float(target_resolution) <= 0:
+                raise ValueError(
+                    "The target resolution for %s must be positive, you entered %s"
+                    % (coord, target_resolution)
+                )
+            if coord == "time":
+                native = int(self.times["grads_step"][0])
+            elif coord == "lev":
+                native = 1
+            else:
+                native = abs(float(self.coords[coord]["resolution"]))
+            return max(1, int(round(float(target_resolution) / native)))
+
+        if isinstance(stride, dict):
+            stride = stride.get(coord)
+        elif coord not in ["lat", "lon"]:
+            stride = None
+        if stride is None:
+            return 1
+        if int(stride) < 1:
+            raise ValueError(
+                "The stride for %s must be a positive integer, you entered %s"
+                % (coord, stride)
+            )
+        return int(stride)
+
+    def value_input_to_index(self, coord, inpt, stride=1):
         """Turns a chosen value of a coordinate/coordinate range to the index in the forecast array
 
+        Note
+        ----
+        Longitude ranges can't cross the prime meridian (e.g. [-8:2]) since the forecast's longitudes go from
+        0 to 360, so they have to be requested as two ranges (e.g. [352:359.75] and [0:2]). A range covering
+        360 degrees or more gives every longitude.
+
         Args:
             coord (string): The short name of the coordinate to convert
             inpt (float/str): The value or range requested, for a range a string in the format [min_val:max_val] is required
+            stride (int, optional): Take every nth point of a range. Defaults to 1.
 
         Raises:
             ValueError: Incorrect inpt format
+            ValueError: Longitude range crosses the prime meridian
 
         Returns:
             str: Index of coordinate value(s) as the forecast requires it (i.e. within [])
@@ -278,12 +499,26 @@ class Forecast:
             if inpt[0] == "[" and inpt[-1] == "]" and ":" in inpt:
                 val_1 = float(re.findall(r"\[(.*?):", inpt)[0])
                 val_2 = float(re.findall(r"\:(.*?)]", inpt)[0])
+                val_1, val_2 = min(val_1, val_2), max(val_1, val_2)
+                if coord == "lon" and val_2 - val_1 >= 360:
+                    return index_range(
+                        0, int(self.coords["lon"]["grads_size"]) - 1, stride
+                    )
                 if coord == "lon":
                     val_1 = val_1 % 360
                     val_2 = val_2 % 360
-                val_min = self.value_to_index(coord, min(val_1, val_2))
-                val_max = self.value_to_index(coord, max(val_1, val_2))
-                ind = "[%s:%s]" % (val_min, val_max)
+                    if val_1 > val_2:
+                        raise ValueError(
+                            "The longitude range {inpt} crosses the prime meridian, longitudes go from 0 to 360 so it must be requested as two ranges ([{start}:{end}] and [0:{stop}])".format(
+                                inpt=inpt,
+                                start=val_1,
+                                end=self.coords["lon"]["maximum"],
+                                stop=val_2,
+                            )
+                        )
+                val_min = self.value_to_index(coord, val_1)
+                val_max = self.value_to_index(coord, val_2)
+                ind = index_range(val_min, val_max, stride)
             else:
                 try:
                     inpt = float(inpt)  # isnumeric apparently doesn't work for floats
@@ -354,28 +589,16 @@ class Forecast:
         possibles = sorted(possibles, key=lambda tup: tup[2])
         return possibles
 
-    def get_windprofile(self, date_time, lat, lon):
-        """Finds the verticle wind profile for a location. I wrote this since it is what
-        I require in another program. The U/V compoents of wind with sigma do not go down to
-        the surface so the surface components are also included as well as a pressure altitude
-        change of x- variable.
+    def interpolate_windprofile(self, info):
+        """Makes the wind profile interpolators for get_windprofile
 
         Args:
-            date_time (string): datetime requested (parser used so any format fine)
-            lat (string or number): Latitude for data
-            lon (string or number): Longitude for data
+            info (File): Downloaded windprofile_variables for one location
 
         Returns:
             interpolation object: U component of wind interpolater by altitude
             interpolation object: V component of wind interpolater by altitude
         """
-        info = self.get(
-            ["ugrdprs", "vgrdprs", "ugrd10m", "vgrd10m", "hgtsfc", "hgtprs"],
-            date_time,
-            lat,
-            lon,
-        )
-
         u_wind = list(info.variables["ugrdprs"].data.flatten()) + list(
             info.variables["ugrd10m"].data.flatten()
         )
@@ -394,6 +617,200 @@ class Forecast:
             alts, v_wind, fill_value=(v_wind[-1], v_wind[-2]), bounds_error=False
         )
 
+
+class Forecast(BaseForecast):
+    """Object that can be manipulated to get forecast information"""
+
+    def __init__(self, resolution="0p25", timestep=""):
+        """Setting up the forecast object by specifying the forecast type
+
+        Args:
+            resolution (str, optional): The forecast resulution, choices are 1p00, 0p50 and 0p25. Defaults to "0p25".
+            timestep (str, optional): The timestep of the forecast to use, most do not have a choice but 0p25 can be 3hr (default) or 1hr. Defaults to "".
+        """
+        BaseForecast.__init__(self, resolution, timestep)
+        self.times, self.coords, self.variables = get_attributes(
+            resolution, self.timestep
+        )
+
+    def get(self, variables, date_time, lat, lon, stride=None, target_resolution=None):
+        """Returns the latest forecast available for the requested date and time
+
+        Note
+        ----
+        - "raw" since you have to put indexes in rather than coordinates and it returns a file object rather than a processed file
+        - If a variable has level dependance, you get all the levels - it seems extremely hard to impliment otherwise
+        - Strides are applied by the server (OpenDAP [start:stride:stop]) so only the downsampled points are downloaded and decoded
+
+        Args:
+            variables (list): list of required variables by short name, including derived variables (see getgfs.derived)
+            date_time (string or tuple): datetime requested (parser used so any format fine), or a (start, end) tuple for a range of timesteps from the run covering start
+            lat (string or number): latitude in the format "[min:max]" or a single value
+            lon (string or number): longitude in the format "[min:max]" or a single value
+            stride (int or dict, optional): Take every nth point, an int applies to lat and lon, a dict (e.g. {"lat": 4, "lon": 4, "lev": 2, "time": 3}) sets each coordinate. Defaults to None.
+            target_resolution (float or dict, optional): Target resolution instead of a stride, in degrees for lat/lon, hours for time and levels for lev. A number applies to lat and lon. Defaults to None.
+
+        Raises:
+            ValueError: Invalid variable choice
+            ValueError: Level dependance needs to be specified for chosen variable
+            Exception: Unknown failure to download the file
+
+        Returns:
+            File Object: File object with the downloaded variable data (see File documentation), transfer has the compressed and uncompressed size of the response
+        """
+
+        run = self.datetime_to_forecast(self.run_time(date_time))
+        request = self.prepare(
+            variables, date_time, lat, lon, run, stride, target_resolution
+        )
+        r = fetch(
+            self.query_url(
+                request["forecast_date"],
+                request["forecast_time"],
+                "ascii?{query}".format(query=request["query"]),
+            )
+        )
+        return self.decode_response(variables, request, r)
+
+    def check_avail(self, forecast_date, forecast_time):
+        r = fetch(
+            self.query_url(forecast_date, forecast_time, "ascii?gustsfc[0][540][1260]")
+        )
+        if r.text[:6] == "<html>":
+            return False
+        else:
+            return True
+
+    def latest_run(self):
+        """Finds the most recent forecast run that is available
+
+        Raises:
+            ValueError: No run from the last week is available
+
+        Returns:
+            string: forecast date
+            string: forecast run
+        """
+        for forecast_date, forecast_time in self.recent_runs():
+            if self.run_available(forecast_date, forecast_time):
+                return forecast_date, forecast_time
+        raise ValueError("No forecast run from the last week is available")
+
+    def run_available(self, forecast_date, forecast_time):
+        """Checks if a forecast run is available, remembering runs that have been found
+
+        Args:
+            forecast_date (string): Forecast date in the format YYYYMMDD
+            forecast_time (string): Forecast run hour
+
+        Returns:
+            bool: Whether the run is available
+        """
+        run = "%s%02d" % (forecast_date, int(forecast_time))
+        if run in self.available_runs:
+            return True
+        if self.check_avail(forecast_date, forecast_time):
+            self.available_runs.add(run)
+            return True
+        return False
+
+    def datetime_to_forecast(self, date_time):
+        """Works out which forecast date/run/time is required for the latest values for a chosen time
+
+        Note
+        ----
+        Many datetimes can be resolved at once by passing an array (or list) of them, this is done in one
+        vectorised pass against a single "now" and only checks the availability of each distinct run once
+
+        Args:
+            date_time (string, datetime, numpy.datetime64 or array): The date and time of the desired forecast, parser is used for strings so any format is valid e.g. 20210205 11pm
+
+        Raises:
+            ValueError: The date time requested is not available from the NOAA at this time
+
+        Returns:
+            string: forecast date (an array for an array of datetimes)
+            string: forecast run (an array for an array of datetimes)
+            string: forecast query time (the appropriate timestep within the forecast), an array of int indices for an array of datetimes
+        """
+        plan = self.plan_runs(date_time)
+        runs = []
+        for candidate in plan["candidates"]:
+            while not self.run_available(
+                candidate.strftime("%Y%m%d"), candidate.strftime("%H")
+            ):
+                candidate = previous_run(candidate, plan["earliest"])
+            runs.append(candidate)
+        return self.resolve_runs(plan, runs)
+
+    def get_windprofile(self, date_time, lat, lon):
+        """Finds the verticle wind profile for a location. I wrote this since it is what
+        I require in another program. The U/V compoents of wind with sigma do not go down to
+        the surface so the surface components are also included as well as a pressure altitude
+        change of x- variable.
+
+        Args:
+            date_time (string): datetime requested (parser used so any format fine)
+            lat (string or number): Latitude for data
+            lon (string or number): Longitude for data
+
+        Returns:
+            interpolation object: U component of wind interpolater by altitude
+            interpolation object: V component of wind interpolater by altitude
+        """
+        return self.interpolate_windprofile(
+            self.get(windprofile_variables, date_time, lat, lon)
+        )
+
+    def variable(self, name, date_time=None, chunks=None):
+        """Gets a lazy handle on a variable which only downloads the parts of it that are indexed
+
+        Note
+        ----
+        Index with numpy style indices (e.g. `forecast.variable("tmp2m")[0, 400:440, 0:40]`) or with
+        coordinate values through loc (e.g. `forecast.variable("tmp2m").loc["20210227 06:00", 10:20, 0:10]`)
+
+        Args:
+            name (string): Short name of the variable
+            date_time (string, optional): A datetime within the forecast run to use, the latest run if None. Defaults to None.
+            chunks (dict, optional): Size of the cached chunks by dimension. Defaults to None.
+
+        Raises:
+            ValueError: Invalid variable choice
+
+        Returns:
+            RemoteVariable: Lazy variable (see RemoteVariable documentation)
+        """
+        if name not in self.variables.keys():
+            raise ValueError(
+                "The variable {name} is not a valid choice for this weather model".format(
+                    name=name
+                )
+            )
+        from .remote import RemoteVariable
+
+        if date_time is None:
+            forecast_date, forecast_time = self.latest_run()
+        else:
+            forecast_date, forecast_time, _ = self.datetime_to_forecast(date_time)
+        return RemoteVariable(self, name, forecast_date, forecast_time, chunks)
+
+    def aggregate(self, variables, date_time, lat, lon, **kwargs):
+        """Calculates statistics over a region as it is downloaded without building the full arrays, see aggregate.aggregate for the options
+
+        Args:
+            variables (list): list of required variables by short name
+            date_time (string or tuple): datetime requested, or a (start, end) tuple for a range of timesteps
+            lat (string or number): latitude in the format "[min:max]" or a single value
+            lon (string or number): longitude in the format "[min:max]" or a single value
+
+        Returns:
+            dict: For each variable a dict of numpy arrays over time (and level) of each statistic
+        """
+        from .aggregate import aggregate
+
+        return aggregate(self, variables, date_time, lat, lon, **kwargs)
+
     def __str__(self):
         print(type(self))
         return "GFS forecast with resolution %s" % self.resolution
@@ -402,6 +819,12 @@ class Forecast:
 def get_attributes(res, step):
     """Finds the available variables and coordinates for a given forecast
 
+    Note
+    ----
+    The attributes are cached in the atts folder. The cache is locked so that when several processes start at
+    once only one downloads the attributes and the others wait and then read its result, and files are written
+    atomically so a crashed process can't leave a corrupt cache behind.
+
     Args:
         res (str, optional): The forecast resulution, choices are 1p00, 0p50 and 0p25. Defaults to "0p25".
         step (str, optional): The timestep of the forecast to use, most do not have a choice but 0p25 can be 3hr (default) or 1hr. Defaults to "".
@@ -415,99 +838,243 @@ def get_attributes(res, step):
         dict: Coordinates for the forecast with their short name, number of steps, min, max, resolution
         dict: Variables with all the information about them
     """
-    with open(config_file) as f:
-        config = json.load(f)
-    if "{res}{step}".format(res=res, step=step) not in config["saved_atts"]:
-        if datetime.utcnow().hour < 6:
-            date = datetime.utcnow() - timedelta(days=1)
-        else:
-            date = datetime.utcnow()
-        r = requests.get(
-            url.format(
-                res=res,
-                step=step,
-                date=date.strftime("%Y%m%d"),
-                hour=0,
-                info="das",
-            )
+    data = load_attributes(res, step)
+    if data is None:
+        with FileLock(attribute_lock.format(res=res, step=step)):
+            # Another process may have downloaded them while we were waiting for the lock
+            data = load_attributes(res, step)
+            if data is None:
+                data = save_attributes(res, step, *download_attributes(res, step))
+                with FileLock(config_lock):
+                    record_attributes(res, step)
+    return data["time"], data["coords"], data["variables"]
+
+
+def check_forecast(resolution, timestep):
+    """Checks the forecast resolution and timestep are a valid choice
+
+    Args:
+        resolution (str): The forecast resulution, choices are 1p00, 0p50 and 0p25
+        timestep (str): The timestep of the forecast, "" or 1hr for 0p25
+
+    Raises:
+        ValueError: Invalid resolution
+        ValueError: Invalid timestep
+
+    Returns:
+        str: The timestep as it appears in the forecast name (e.g. "_1hr")
+    """
+    if timestep != "":
+        timestep = "_" + timestep
+
+    if resolution not in ["1p00", "0p50", "0p25"]:
+        raise ValueError(
+            "You have entered an invalid forecast resulution, the choices are 1p00, 0p50 and 0p25. You entered %s"
+            % resolution
         )
-        if r.status_code != 200:
-            raise Exception("The forecast resolution and timestep was not found")
-        elif r.text[:5] == "Error":
-            raise Exception(
-                "The forcast resolution and timestep was not found, the service returned the error {err}".format(
-                    err=re.findall('(message = ")((.|\n)*)"', r.text)
-                )
-            )
-        search_text = re.sub("\s{2,}", "", r.text[12:-2])
-        raws = re.findall(r"(.*?) \{(.*?)\}", search_text)
-        variables = {}
-        coords = {}
-        for var in raws:
-            attributes = {}
-            atts = var[1].split(";")
-            # Extraction from a line could be simplified to a function
-            if var[0] not in ["time", "lat", "lon", "lev"]:
-                for att in atts:
-                    iden, val = extract_line(
-                        ["_FillValue", "missing_value", "long_name"], att
-                    )
-                    if iden != None:
-                        attributes[iden] = val
-                variables[var[0]] = attributes
-            elif var[0] == "time":
-                for att in atts:
-                    iden, val = extract_line(["grads_size", "grads_step"], att)
-                    if iden != None:
-                        attributes[iden] = val
-                time = attributes
-            else:
-                for att in atts:
-                    iden, val = extract_line(
-                        ["grads_dim", "grads_size", "minimum", "maximum", "resolution"],
-                        att,
-                    )
-                    if iden != None:
-                        attributes[iden] = val
-                coords[var[0]] = attributes
-
-        r = requests.get(
-            url.format(
-                res=res,
-                step=step,
-                date=(date.today() - timedelta(days=2)).strftime("%Y%m%d"),
-                hour=0,
-                info="dds",
-            )
+    if (timestep != "" and resolution != "0p25") or (
+        timestep not in ["_1hr", ""] and resolution == "0p25"
+    ):
+        raise ValueError(
+            "You have entered an invalid forecast timestep, the only choice is 1hr for 0p25 forecasts or the default. You entered %s"
+            % timestep
         )
-        if r.status_code != 200:
-            raise RuntimeError("The forecast resolution and timestep was not found")
-        arrays = re.findall(r"ARRAY:\n(.*?)\n", r.text)
+    return timestep
 
-        if len(arrays) == 0:
-            raise RuntimeError(
-                "The forecast datetime was not found, please report as this should no longer occur"
-            )
-        for array in arrays:
-            var = re.findall(r"(.*?)\[", array)[0].split()[1]
-            if var in variables.keys():
-                lev_dep = False
-                for dim in re.findall(r"(.*?)\[", array):
-                    if dim.split()[0] == "lev":
-                        lev_dep = True
-                variables[var]["level_dependent"] = lev_dep
-
-        save = {"time": time, "coords": coords, "variables": variables}
-        with open(attribute_file.format(res=res, step=step), "w+") as f:
-            json.dump(save, f)
-        config["saved_atts"].append("{res}{step}".format(res=res, step=step))
-        with open(config_file, "w+") as f:
-            json.dump(config, f)
-        return time, coords, variables
-    else:
+
+def save_attributes(res, step, time, coords, variables):
+    """Saves downloaded attributes to the atts folder, should be called holding the attribute lock and followed by record_attributes
+
+    Args:
+        res (str): The forecast resulution
+        step (str): The timestep of the forecast
+        time (dict): Time attributes
+        coords (dict): Coordinates for the forecast
+        variables (dict): Variables with all the information about them
+
+    Returns:
+        dict: The saved time, coords and variables
+    """
+    data = {"time": time, "coords": coords, "variables": variables}
+    atomic_write(attribute_file.format(res=res, step=step), json.dumps(data))
+    return data
+
+
+def record_attributes(res, step):
+    """Adds saved attributes to the config so they are used, should be called holding the config lock
+
+    Args:
+        res (str): The forecast resulution
+        step (str): The timestep of the forecast
+    """
+    config = load_config()
+    name = "{res}{step}".format(res=res, step=step)
+    if name not in config["saved_atts"]:
+        config["saved_atts"].append(name)
+    atomic_write(config_file, json.dumps(config))
+
+
+def load_config():
+    """Reads the config file, starting a new one if it is missing or unreadable
+
+    Returns:
+        dict: Config with the list of saved attributes
+    """
+    try:
+        with open(config_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"saved_atts": ["Na"]}
+
+
+def load_attributes(res, step):
+    """Reads saved attributes for a forecast
+
+    Args:
+        res (str): The forecast resulution
+        step (str): The timestep of the forecast
+
+    Returns:
+        dict: Saved time, coords and variables or None if they haven't been saved or the file is unreadable
+    """
+    if "{res}{step}".format(res=res, step=step) not in load_config()["saved_atts"]:
+        return None
+    try:
         with open(attribute_file.format(res=res, step=step)) as f:
             data = json.load(f)
-        return data["time"], data["coords"], data["variables"]
+    except (OSError, ValueError):
+        return None
+    if not all(k in data for k in ["time", "coords", "variables"]):
+        return None
+    return data
+
+
+def download_attributes(res, step):
+    """Downloads the available variables and coordinates for a given forecast from the das and dds pages
+
+    Args:
+        res (str): The forecast resulution
+        step (str): The timestep of the forecast
+
+    Raises:
+        Exception: Failed to download the requested resolution and forecast
+        RuntimeError: Failed to download the other attributes
+
+    Returns:
+        dict: Time attributes (the number of timesteps and the size of the timesteps)
+        dict: Coordinates for the forecast with their short name, number of steps, min, max, resolution
+        dict: Variables with all the information about them
+    """
+    das_url, dds_url = attribute_urls(res, step)
+    return parse_attributes(fetch(das_url), fetch(dds_url))
+
+
+def attribute_urls(res, step):
+    """The addresses of the das and dds pages that describe a forecast
+
+    Args:
+        res (str): The forecast resulution
+        step (str): The timestep of the forecast
+
+    Returns:
+        str: das address
+        str: dds address
+    """
+    if datetime.utcnow().hour < 6:
+        date = datetime.utcnow() - timedelta(days=1)
+    else:
+        date = datetime.utcnow()
+    return url.format(
+        res=res,
+        step=step,
+        date=date.strftime("%Y%m%d"),
+        hour=0,
+        info="das",
+    ), url.format(
+        res=res,
+        step=step,
+        date=(date.today() - timedelta(days=2)).strftime("%Y%m%d"),
+        hour=0,
+        info="dds",
+    )
+
+
+def parse_attributes(das, dds):
+    """Reads the available variables and coordinates from the responses for the das and dds pages
+
+    Args:
+        das (Response): Response for the das page
+        dds (Response): Response for the dds page
+
+    Raises:
+        Exception: Failed to download the requested resolution and forecast
+        RuntimeError: Failed to download the other attributes
+
+    Returns:
+        dict: Time attributes (the number of timesteps and the size of the timesteps)
+        dict: Coordinates for the forecast with their short name, number of steps, min, max, resolution
+        dict: Variables with all the information about them
+    """
+    r = das
+    if r.status_code != 200:
+        raise Exception("The forecast resolution and timestep was not found")
+    elif r.text[:5] == "Error":
+        raise Exception(
+            "The forcast resolution and timestep was not found, the service returned the error {err}".format(
+                err=re.findall('(message = ")((.|\n)*)"', r.text)
+            )
+        )
+    search_text = re.sub("\s{2,}", "", r.text[12:-2])
+    raws = re.findall(r"(.*?) \{(.*?)\}", search_text)
+    variables = {}
+    coords = {}
+    for var in raws:
+        attributes = {}
+        atts = var[1].split(";")
+        # Extraction from a line could be simplified to a function
+        if var[0] not in ["time", "lat", "lon", "lev"]:
+            for att in atts:
+                iden, val = extract_line(
+                    ["_FillValue", "missing_value", "long_name"], att
+                )
+                if iden != None:
+                    attributes[iden] = val
+            variables[var[0]] = attributes
+        elif var[0] == "time":
+            for att in atts:
+                iden, val = extract_line(["grads_size", "grads_step"], att)
+                if iden != None:
+                    attributes[iden] = val
+            time = attributes
+        else:
+            for att in atts:
+                iden, val = extract_line(
+                    ["grads_dim", "grads_size", "minimum", "maximum", "resolution"],
+                    att,
+                )
+                if iden != None:
+                    attributes[iden] = val
+            coords[var[0]] = attributes
+
+    r = dds
+    if r.status_code != 200:
+        raise RuntimeError("The forecast resolution and timestep was not found")
+    arrays = re.findall(r"ARRAY:\n(.*?)\n", r.text)
+
+    if len(arrays) == 0:
+        raise RuntimeError(
+            "The forecast datetime was not found, please report as this should no longer occur"
+        )
+    for array in arrays:
+        var = re.findall(r"(.*?)\[", array)[0].split()[1]
+        if var in variables.keys():
+            lev_dep = False
+            for dim in re.findall(r"(.*?)\[", array):
+                if dim.split()[0] == "lev":
+                    lev_dep = True
+            variables[var]["level_dependent"] = lev_dep
+
+    return time, coords, variables
 
 
 def extract_line(possibles, line):
@@ -534,6 +1101,64 @@ def extract_line(possibles, line):
     return None, None
 
 
+def index_range(start, stop, stride=1):
+    """Formats an index range as an OpenDAP hyperslab
+
+    Args:
+        start (int): First index
+        stop (int): Last index (inclusive)
+        stride (int, optional): Take every nth index. Defaults to 1.
+
+    Returns:
+        str: Hyperslab in the format [start:stop] or [start:stride:stop]
+    """
+    if stride > 1:
+        return "[%s:%s:%s]" % (start, stride, stop)
+    return "[%s:%s]" % (start, stop)
+
+
+def hyperslab_indices(hyperslab):
+    """Lists the indices selected by an OpenDAP hyperslab
+
+    Args:
+        hyperslab (str): Hyperslab in the format [index], [start:stop] or [start:stride:stop]
+
+    Returns:
+        numpy array: Indices
+    """
+    parts = [int(p) for p in hyperslab[1:-1].split(":")]
+    if len(parts) == 3:
+        return np.arange(parts[0], parts[2] + 1, parts[1])
+    return np.arange(parts[0], parts[-1] + 1)
+
+
+def to_datetime64(date_time):
+    """Converts datetimes in any of the accepted formats to numpy datetimes
+
+    Args:
+        date_time (string, datetime, numpy.datetime64 or array of them): Datetime(s), strings are parsed so any format is valid and timezone aware datetimes are converted to UTC
+
+    Returns:
+        numpy array: datetime64[s] array with the same shape as the input
+    """
+    arr = np.asarray(date_time)
+    if arr.dtype.kind == "M":
+        return arr.astype("datetime64[s]")
+
+    def convert(value):
+        if isinstance(value, str):
+            value = dateutil.parser.parse(value)
+        elif isinstance(value, np.datetime64):
+            return value
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    return np.array(
+        [convert(v) for v in arr.reshape(-1)], dtype="datetime64[s]"
+    ).reshape(arr.shape)
+
+
 def hour_round(t):
     """Rounds to the nearest hour for a datetime object
 
@@ -546,3 +1171,22 @@ def hour_round(t):
     return t.replace(second=0, microsecond=0, minute=0, hour=t.hour) + timedelta(
         hours=t.minute // 30
     )
+
+
+def previous_run(run, earliest):
+    """The run before a forecast run
+
+    Args:
+        run (datetime): Forecast run
+        earliest (datetime): The earliest run that may be available
+
+    Raises:
+        ValueError: There is no run available from the last week
+
+    Returns:
+        datetime: The forecast run 6 hours earlier
+    """
+    run -= timedelta(hours=6)
+    if run < earliest:
+        raise ValueError("No forecast run from the last week is available")
+    return run
@@ -0,0 +1,130 @@
+"""Locks on local files so that state can be shared between processes"""
+import asyncio, os, tempfile, time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """Exclusive lock on a file, usable as a context manager
+
+    Note
+    ----
+    Locks are held by the open file so two FileLocks on the same path exclude each other
+    even within one process, which means they can also be used between threads
+    """
+
+    def __init__(self, path):
+        """Set up the lock, the file is created if it doesn't exist
+
+        Args:
+            path (str): Path of the lock file
+        """
+        self.path = path
+        self.file = None
+
+    def acquire(self, blocking=True, poll=0.05):
+        """Take the lock
+
+        Args:
+            blocking (bool, optional): Wait for the lock rather than giving up if it is held. Defaults to True.
+            poll (float, optional): Seconds between attempts when waiting on Windows. Defaults to 0.05.
+
+        Returns:
+            bool: Whether the lock was taken
+        """
+        f = open(self.path, "a+b")
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(
+                        f.fileno(),
+                        fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB,
+                    )
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                self.file = f
+                return True
+            except OSError:
+                if not blocking:
+                    f.close()
+                    return False
+                time.sleep(poll)
+
+    async def acquire_async(self, poll=0.05):
+        """Takes the lock without blocking the event loop, polling until it is free
+
+        Note
+        ----
+        Polling (rather than waiting in a thread) means cancelling the wait can't leave the lock taken
+
+        Args:
+            poll (float, optional): Seconds between attempts. Defaults to 0.05.
+        """
+        while not self.acquire(blocking=False):
+            await asyncio.sleep(poll)
+
+    def release(self):
+        """Release the lock"""
+        if self.file is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.file.close()
+            self.file = None
+
+    def read(self):
+        """Read the contents of the locked file
+
+        Returns:
+            str: File contents
+        """
+        self.file.seek(0)
+        return self.file.read().decode()
+
+    def write(self, text):
+        """Replace the contents of the locked file
+
+        Args:
+            text (str): New contents
+        """
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(text.encode())
+        self.file.flush()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def atomic_write(path, text):
+    """Writes a file so that readers only ever see the old or the complete new contents
+
+    Args:
+        path (str): File to write
+        text (str): Contents
+    """
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
@@ -0,0 +1,341 @@
+"""Lazy variables that look like arrays and only download the parts that are indexed"""
+import itertools, threading
+import numpy as np
+from .getgfs import index_range
+from .transport import fetch
+
+__copyright__ = """
+    getgfs - a library for extracting weather forecast variables from the NOAA GFS forecast in a pure python, no obscure dependencies way
+    Copyright (C) 2021 Jago Strong-Wright
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>."""
+
+default_chunks = {"time": 1, "lev": None, "lat": 120, "lon": 120}
+
+
+class RemoteVariable:
+    """A forecast variable for one run that downloads data when it is indexed
+
+    Note
+    ----
+    Downloaded data is cached in chunks so indexing the same or overlapping areas again doesn't download
+    them again. Slices with a step are downloaded with a server side stride unless they are already cached.
+    """
+
+    def __init__(self, forecast, name, forecast_date, forecast_time, chunks=None):
+        """Create the variable, nothing is downloaded until it is indexed
+
+        Args:
+            forecast (Forecast): Forecast the variable is from
+            name (string): Short name of the variable
+            forecast_date (string): Forecast date in the format YYYYMMDD
+            forecast_time (string): Forecast run hour
+            chunks (dict, optional): Size of the cached chunks by dimension, None for the whole dimension. Defaults to None.
+        """
+        self.forecast = forecast
+        self.name = name
+        self.forecast_date = forecast_date
+        self.forecast_time = forecast_time
+
+        sizes = {
+            "time": int(forecast.times["grads_size"]),
+            "lev": int(
+                (forecast.coords["lev"]["minimum"] - forecast.coords["lev"]["maximum"])
+                / forecast.coords["lev"]["resolution"]
+            )
+            + 1,
+            "lat": int(forecast.coords["lat"]["grads_size"]),
+            "lon": int(forecast.coords["lon"]["grads_size"]),
+        }
+        if forecast.variables[name]["level_dependent"]:
+            self.dims = ("time", "lev", "lat", "lon")
+        else:
+            self.dims = ("time", "lat", "lon")
+        self.shape = tuple(sizes[d] for d in self.dims)
+
+        chunk_sizes = dict(default_chunks)
+        chunk_sizes.update(chunks or {})
+        self.chunks = tuple(
+            min(chunk_sizes[d] or n, n) for d, n in zip(self.dims, self.shape)
+        )
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.loc = Locator(self)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        """Downloads (if not cached) and returns the indexed data
+
+        Args:
+            key (int, slice or tuple): Numpy style basic index
+
+        Returns:
+            numpy array: Data, with dimensions indexed by an integer removed
+        """
+        ranges, squeeze = self.normalise(key)
+        if any(len(range(start, stop + 1, step)) == 0 for start, stop, step in ranges):
+            data = np.empty(
+                tuple(len(range(start, stop + 1, step)) for start, stop, step in ranges)
+            )
+        else:
+            data = self.read(ranges)
+        return data[tuple(0 if s else slice(None) for s in squeeze)]
+
+    def normalise(self, key):
+        """Turns a numpy style index into an index range for every dimension
+
+        Args:
+            key (int, slice or tuple): Numpy style basic index
+
+        Raises:
+            IndexError: Too many indices or an index out of range
+            TypeError: Unsupported index type
+
+        Returns:
+            list: (start, stop, step) for each dimension, with stop inclusive
+            list: Whether each dimension was indexed with an integer
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if Ellipsis in key:
+            ind = key.index(Ellipsis)
+            key = (
+                key[:ind] + (slice(None),) * (self.ndim - len(key) + 1) + key[ind + 1 :]
+            )
+        if len(key) > self.ndim:
+            raise IndexError(
+                "Too many indices for %s which has dimensions %s"
+                % (self.name, self.dims)
+            )
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        ranges = []
+        squeeze = []
+        for k, n, dim in zip(key, self.shape, self.dims):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(n)
+                if step < 1:
+                    raise IndexError("Negative steps are not supported")
+                ranges.append((start, stop - 1, step))
+                squeeze.append(False)
+            elif isinstance(k, (int, np.integer)):
+                k = int(k)
+                if k < 0:
+                    k += n
+                if not 0 <= k < n:
+                    raise IndexError(
+                        "Index %s is out of range for %s with size %s" % (k, dim, n)
+                    )
+                ranges.append((k, k, 1))
+                squeeze.append(True)
+            else:
+                raise TypeError(
+                    "Only integers and slices can be used to index remote variables, you entered %s"
+                    % k
+                )
+        return ranges, squeeze
+
+    def read(self, ranges):
+        """Gets the data for index ranges from the cache, downloading any chunks that are missing
+
+        Args:
+            ranges (list): (start, stop, step) for each dimension, with stop inclusive
+
+        Returns:
+            numpy array: Data with all dimensions kept
+        """
+        needed = [
+            sorted(set(i // c for i in range(start, stop + 1, step)))
+            for (start, stop, step), c in zip(ranges, self.chunks)
+        ]
+        with self.lock:
+            missing = [k for k in itertools.product(*needed) if k not in self.cache]
+
+        if len(missing) > 0:
+            if any(step > 1 for start, stop, step in ranges):
+                # Only the strided points are downloaded so they can't fill whole chunks
+                return self.download(ranges)
+            self.store(missing)
+
+        # Put the needed chunks together then take the requested part out of them
+        box_start = [ids[0] * c for ids, c in zip(needed, self.chunks)]
+        box_stop = [
+            min((ids[-1] + 1) * c, n)
+            for ids, c, n in zip(needed, self.chunks, self.shape)
+        ]
+        block = np.empty(tuple(b - a for a, b in zip(box_start, box_stop)))
+        with self.lock:
+            for k in itertools.product(*needed):
+                chunk = self.cache[k]
+                block[
+                    tuple(
+                        slice(i * c - a, i * c - a + s)
+                        for i, c, a, s in zip(k, self.chunks, box_start, chunk.shape)
+                    )
+                ] = chunk
+        return block[
+            tuple(
+                slice(start - a, stop - a + 1, step)
+                for (start, stop, step), a in zip(ranges, box_start)
+            )
+        ]
+
+    def store(self, missing):
+        """Downloads the box covering the missing chunks in one request and caches each chunk
+
+        Args:
+            missing (list): Chunk indices that aren't cached
+        """
+        first = [min(k[d] for k in missing) for d in range(self.ndim)]
+        last = [max(k[d] for k in missing) for d in range(self.ndim)]
+        ranges = [
+            (f * c, min((l + 1) * c, n) - 1, 1)
+            for f, l, c, n in zip(first, last, self.chunks, self.shape)
+        ]
+        data = self.download(ranges)
+        with self.lock:
+            for k in itertools.product(*[range(f, l + 1) for f, l in zip(first, last)]):
+                self.cache[k] = data[
+                    tuple(
+                        slice((i - f) * c, (i - f + 1) * c)
+                        for i, f, c in zip(k, first, self.chunks)
+                    )
+                ].copy()
+
+    def download(self, ranges):
+        """Downloads index ranges of the variable
+
+        Args:
+            ranges (list): (start, stop, step) for each dimension, with stop inclusive
+
+        Returns:
+            numpy array: Data with all dimensions kept
+        """
+        hyperslabs = [index_range(*r) for r in ranges]
+        r = fetch(
+            self.forecast.query_url(
+                self.forecast_date,
+                self.forecast_time,
+                "ascii?{name}{slabs}".format(name=self.name, slabs="".join(hyperslabs)),
+            )
+        )
+        res = self.forecast.response_to_file(
+            r.status_code,
+            r.text,
+            self.forecast_date,
+            self.forecast_time,
+            hyperslabs[0],
+            hyperslabs[-2],
+            hyperslabs[-1],
+        )
+        return res.variables[self.name].data
+
+    def clear_cache(self):
+        """Forgets all the downloaded chunks"""
+        with self.lock:
+            self.cache = {}
+
+    def __str__(self):
+        return "%s %s from the %sz %s forecast" % (
+            self.name,
+            self.shape,
+            self.forecast_time,
+            self.forecast_date,
+        )
+
+
+class Locator:
+    """Indexes a remote variable by coordinate values rather than indices
+
+    Note
+    ----
+    Times are datetime strings (parser used so any format fine), latitudes and longitudes are in degrees
+    and levels are indices. Slices include both ends and their steps are in the coordinate's units
+    (hours for time)
+    """
+
+    def __init__(self, variable):
+        """Create locator
+
+        Args:
+            variable (RemoteVariable): Variable to index
+        """
+        self.variable = variable
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > self.variable.ndim:
+            raise IndexError(
+                "Too many indices for %s which has dimensions %s"
+                % (self.variable.name, self.variable.dims)
+            )
+        return self.variable[
+            tuple(self.to_index(dim, k) for dim, k in zip(self.variable.dims, key))
+        ]
+
+    def to_index(self, dim, value):
+        """Converts a coordinate value or slice of values to an index or slice of indices
+
+        Args:
+            dim (string): Dimension name
+            value (float, str or slice): Coordinate value(s)
+
+        Raises:
+            IndexError: A time outside the forecast run or a longitude slice that crosses the prime meridian
+
+        Returns:
+            int or slice: Index for the dimension
+        """
+        if isinstance(value, slice) and dim == "lon":
+            if value.start is not None and value.stop is not None:
+                west, east = min(value.start, value.stop), max(value.start, value.stop)
+                if east - west >= 360:
+                    value = slice(None, None, value.step)
+                elif west % 360 > east % 360:
+                    raise IndexError(
+                        "The longitude slice %s:%s crosses the prime meridian, longitudes go from 0 to 360 so it must be indexed as two slices"
+                        % (value.start, value.stop)
+                    )
+        if isinstance(value, slice):
+            start, stop = 0, self.variable.shape[self.variable.dims.index(dim)] - 1
+            if value.start is not None:
+                start = self.to_index(dim, value.start)
+            if value.stop is not None:
+                stop = self.to_index(dim, value.stop)
+            start, stop = min(start, stop), max(start, stop)
+            step = 1
+            if value.step is not None:
+                step = self.variable.forecast.coord_stride(
+                    dim, target_resolution={dim: value.step}
+                )
+            return slice(start, stop + 1, step)
+        if dim == "time":
+            try:
+                return self.variable.forecast.time_to_index(
+                    self.variable.forecast_date, self.variable.forecast_time, value
+                )
+            except ValueError as e:
+                raise IndexError(str(e))
+        if dim == "lev":
+            return int(value)
+        if dim == "lon":
+            value = value % 360
+        return self.variable.forecast.value_to_index(dim, value)
@@ -0,0 +1,115 @@
+"""Coalesces identical requests that are in flight at the same time
+
+When lots of callers ask for exactly the same thing at once (e.g. after a cache miss in a server) only
+the first one actually makes the request, the rest wait for it and share the result.
+"""
+import asyncio, threading
+
+__copyright__ = """
+    getgfs - a library for extracting weather forecast variables from the NOAA GFS forecast in a pure python, no obscure dependencies way
+    Copyright (C) 2021 Jago Strong-Wright
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>."""
+
+
+class Call:
+    """A call in flight that other threads can wait on"""
+
+    def __init__(self):
+        """Create call"""
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time, sharing the result with everyone who asked for it"""
+
+    def __init__(self):
+        """Create an empty group of calls"""
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.async_calls = {}
+
+    def do(self, key, function, *args, **kwargs):
+        """Calls the function unless a call with the same key is already in flight, in which case it waits for that one
+
+        Args:
+            key (hashable): Identifies identical calls (e.g. the url)
+            function (function): Function to call
+
+        Returns:
+            The result of the function (shared between all callers with the same key)
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = Call()
+                self.calls[key] = call
+
+        if leader:
+            try:
+                call.result = function(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    async def do_async(self, key, function, *args, **kwargs):
+        """Awaitable version of do for coroutine functions, calls are shared within an event loop
+
+        Note
+        ----
+        The call runs as its own task so cancelling any of the callers (including the first) doesn't
+        cancel it for the others
+
+        Args:
+            key (hashable): Identifies identical calls (e.g. the url)
+            function (coroutine function): Function to await
+
+        Returns:
+            The result of the function (shared between all callers with the same key)
+        """
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            task = self.async_calls.get((loop, key))
+            if task is None:
+                task = loop.create_task(function(*args, **kwargs))
+                self.async_calls[(loop, key)] = task
+                task.add_done_callback(lambda t: self.finished(loop, key, t))
+        return await asyncio.shield(task)
+
+    def finished(self, loop, key, task):
+        """Forgets a finished async call so the next one with the same key is made again
+
+        Args:
+            loop (asyncio.AbstractEventLoop): Loop the call ran on
+            key (hashable): Key of the call
+            task (asyncio.Task): The finished call
+        """
+        with self.lock:
+            if self.async_calls.get((loop, key)) is task:
+                del self.async_calls[(loop, key)]
+        # Everyone waiting may have been cancelled, so mark the exception as seen
+        if not task.cancelled():
+            task.exception()
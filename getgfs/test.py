@@ -1,6 +1,17 @@
 import unittest
 from .getgfs import *
 from .decode import *
+from .cli import plan_tasks, run_jobs
+from . import derived
+from .transport import RateLimiter
+from . import transport
+from .locking import FileLock, atomic_write
+from .singleflight import SingleFlight
+from . import remote, aggregate, aio
+from contextlib import contextmanager
+from . import getgfs as gfs_module
+from unittest import mock
+import asyncio, gzip, tempfile, threading, time, zlib
 
 # Seems like these aren't actually working
 
@@ -128,12 +139,694 @@ class Decode(unittest.TestCase):
     def test_variables(self):
         self.assertEqual(
             example.variables["hgtprs"].coords["time"].values,
-            [737842.0, 737842.125, 737842.25, 737842.375, 737842.0],
+            [737842.0, 737842.125, 737842.25, 737842.375, 737842.5],
         )
 
     def test_data(self):
         self.assertEqual(example.variables["hgtmwl"].data, [[[9504.847]]])
 
 
+class Stride(unittest.TestCase):
+    def test_range(self):
+        f = Forecast("0p25", "1hr")
+        self.assertEqual(f.value_input_to_index("lat", "[10:20]", 4), "[400:4:440]")
+        self.assertEqual(f.value_input_to_index("lat", 10, 4), "[400]")
+
+    def test_resolution(self):
+        f = Forecast("0p25", "1hr")
+        self.assertEqual(f.coord_stride("lon", target_resolution=1), 4)
+        self.assertEqual(f.coord_stride("lev", target_resolution=1), 1)
+        self.assertEqual(f.coord_stride("time", {"time": 3}), 3)
+        self.assertEqual(f.coord_stride("lev", 2), 1)
+
+    def test_decode(self):
+        strided = File(
+            """tmp2m, [1][2][2]
+[0][0], 250.1, 251.2
+[0][1], 252.3, 253.4
+
+
+time, [1]
+737842.0
+lat, [2]
+10.0, 11.0
+lon, [2]
+0.0, 1.0"""
+        )
+        self.assertEqual(strided.variables["tmp2m"].coords["lat"].values, [10.0, 11.0])
+        self.assertEqual(strided.variables["tmp2m"].data[0][1][1], 253.4)
+
+
+class Ranges(unittest.TestCase):
+    def test_meridian(self):
+        f = Forecast("0p25", "1hr")
+        with self.assertRaises(ValueError):
+            f.value_input_to_index("lon", "[-8:2]")
+        self.assertEqual(f.value_input_to_index("lon", "[-8:-2]"), "[1408:1432]")
+        self.assertEqual(f.value_input_to_index("lon", "[6:15]"), "[24:60]")
+        self.assertEqual(f.value_input_to_index("lon", "[-180:180]"), "[0:1439]")
+
+    def test_invalid(self):
+        f = Forecast("0p25", "1hr")
+        run = ("20210227", "00", "[5]")
+        for date_time in [
+            ("20210227 05:00", "20210227 01:00"),
+            ("20210227 05:00",),
+            ("20210227 01:00", "20210227 02:00", "20210227 03:00"),
+            ["20210227 01:00"],
+        ]:
+            with self.assertRaises(ValueError):
+                f.run_time(date_time)
+            with self.assertRaises(ValueError):
+                f.prepare(["tmp2m"], date_time, 10, 0, run, {"time": 2})
+        request = f.prepare(
+            ["tmp2m"], ("20210227 05:00", "20210227 09:00"), 10, 0, run, {"time": 2}
+        )
+        self.assertEqual(request["time"], "[5:2:9]")
+
+    def test_past_run(self):
+        f = Forecast("0p25", "1hr")
+        with self.assertRaises(ValueError):
+            f.prepare(
+                ["tmp2m"],
+                ("20210227 05:00", "20210315 00:00"),
+                10,
+                0,
+                ("20210227", "00", "[5]"),
+            )
+        self.assertEqual(f.time_to_index("20210227", "00", "20210302 00:00"), 72)
+
+
+class Jobs(unittest.TestCase):
+    def test_plan(self):
+        tasks = plan_tasks(
+            [
+                {
+                    "name": "germany",
+                    "variables": ["tmp2m"],
+                    "times": {"start": "20210227 00:00", "end": "20210228 00:00"},
+                    "lat": "[47:55]",
+                    "lon": "[6:15]",
+                    "target_resolution": 0.5,
+                },
+                {
+                    "name": "sites",
+                    "variables": ["gustsfc"],
+                    "times": ["20210227 06:00", "20210227 12:00"],
+                    "points": [[51.5, -0.1], [55.9, -3.2]],
+                },
+            ]
+        )
+        self.assertEqual(len(tasks), 5)
+        self.assertEqual(tasks[0]["date_time"], ("20210227 00:00", "20210228 00:00"))
+        self.assertEqual(tasks[0]["target_resolution"], 0.5)
+        self.assertTrue(tasks[-1]["id"].startswith("sites-t0001-p0001-"))
+        self.assertEqual(len(set(t["id"] for t in tasks)), 5)
+
+    def test_ids(self):
+        job = {
+            "name": "sites",
+            "variables": ["gustsfc"],
+            "times": ["20210227 06:00"],
+            "points": [[51.5, -0.1]],
+        }
+        task_id = plan_tasks([job])[0]["id"]
+        self.assertEqual(plan_tasks([dict(job)])[0]["id"], task_id)
+        self.assertNotEqual(plan_tasks([job], "0p25_1hr")[0]["id"], task_id)
+        for key, value in [
+            ("times", ["20210227 12:00"]),
+            ("points", [[55.9, -3.2]]),
+            ("variables", ["tmp2m"]),
+            ("stride", 2),
+        ]:
+            self.assertNotEqual(
+                plan_tasks([dict(job, **{key: value})])[0]["id"], task_id
+            )
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            plan_tasks([{"variables": ["tmp2m"], "times": ["20210227 06:00"]}])
+        with self.assertRaises(ValueError):
+            plan_tasks(
+                [
+                    {
+                        "variables": ["tmp2m"],
+                        "times": ["20210227 06:00"],
+                        "points": [[51.5, -0.1]],
+                        "resolution": 0.5,
+                    }
+                ]
+            )
+
+    def test_workers(self):
+        limiter = transport.limiter
+        try:
+            with tempfile.TemporaryDirectory() as output:
+                run_jobs({"jobs": []}, output, workers=16)
+            self.assertEqual(transport.limiter.max_in_flight, 16)
+            self.assertEqual(transport.limiter.max_rate, 2)
+        finally:
+            transport.limiter = limiter
+
+
+class Limits(unittest.TestCase):
+    def test_burst(self):
+        limiter = RateLimiter(rate=1, burst=3)
+        delays = [limiter._with_state(take=True) for n in range(4)]
+        self.assertEqual(delays[:3], [0, 0, 0])
+        self.assertGreater(delays[3], 0)
+
+    def test_adapt(self):
+        limiter = RateLimiter(rate=4, min_rate=1)
+        for n in range(4):
+            limiter.throttled()
+        self.assertEqual(limiter.rate, 1)
+        limiter.succeeded()
+        self.assertAlmostEqual(limiter.rate, 1.2)
+
+    def test_shared(self):
+        with tempfile.TemporaryDirectory() as folder:
+            lock_file = os.path.join(folder, "limits.lock")
+            first = RateLimiter(rate=1, burst=2, lock_file=lock_file)
+            second = RateLimiter(rate=1, burst=2, lock_file=lock_file)
+            self.assertEqual(first._with_state(take=True), 0)
+            self.assertEqual(second._with_state(take=True), 0)
+            self.assertGreater(first._with_state(take=True), 0)
+            slots = [second.acquire_slot() for n in range(second.max_in_flight)]
+            self.assertFalse(FileLock("%s.0" % lock_file).acquire(blocking=False))
+            for slot in slots:
+                second.release_slot(slot)
+            self.assertTrue(FileLock("%s.0" % lock_file).acquire(blocking=False))
+
+
+class Cache(unittest.TestCase):
+    def test_single_fetch(self):
+        downloads = []
+
+        def download(res, step):
+            downloads.append(res)
+            time.sleep(0.2)
+            return {"grads_size": "1"}, {}, {}
+
+        with tempfile.TemporaryDirectory() as folder:
+            os.makedirs(os.path.join(folder, "atts"))
+            with mock.patch.multiple(
+                gfs_module,
+                config_file=os.path.join(folder, "config.json"),
+                config_lock=os.path.join(folder, "config.lock"),
+                attribute_file=os.path.join(folder, "atts/{res}{step}.json"),
+                attribute_lock=os.path.join(folder, "atts/{res}{step}.lock"),
+                download_attributes=download,
+            ):
+                atomic_write(os.path.join(folder, "atts/1p00.json"), "{corrupt")
+                results = []
+                workers = [
+                    threading.Thread(
+                        target=lambda: results.append(get_attributes("1p00", ""))
+                    )
+                    for n in range(4)
+                ]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                self.assertEqual(len(downloads), 1)
+                self.assertEqual(results, [({"grads_size": "1"}, {}, {})] * 4)
+                with open(os.path.join(folder, "config.json")) as f:
+                    self.assertIn("1p00", json.load(f)["saved_atts"])
+
+
+class Derived(unittest.TestCase):
+    def test_resolve(self):
+        f = Forecast("0p25", "1hr")
+        self.assertEqual(
+            derived.resolve(["wspd80m", "wpd80m", "tmp2m"], f.variables),
+            ["ugrd80m", "vgrd80m", "pres80m", "tmp80m", "tmp2m"],
+        )
+
+    def test_compute(self):
+        f = Forecast("0p25", "1hr")
+        wind = File(
+            """ugrd10m, [1][1][2]
+[0][0], 3.0, 9.999E20
+
+
+time, [1]
+737842.0
+lat, [1]
+10.0
+lon, [2]
+0.0, 0.25
+vgrd10m, [1][1][2]
+[0][0], -4.0, 1.0
+
+
+time, [1]
+737842.0
+lat, [1]
+10.0
+lon, [2]
+0.0, 0.25"""
+        )
+        res = derived.compute(
+            ["wspd10m", "wdir10m", "ugrd10m"], wind.variables, f.variables
+        )
+        self.assertIs(res["ugrd10m"], wind.variables["ugrd10m"])
+        self.assertEqual(res["ugrd10m"].data[0][0][1], 9.999e20)
+        self.assertEqual(res["wspd10m"].data[0][0][0], 5.0)
+        self.assertTrue(np.isnan(res["wspd10m"].data[0][0][1]))
+        self.assertAlmostEqual(res["wdir10m"].data[0][0][0], 323.13010235)
+        self.assertEqual(list(res["wdir10m"].coords["lon"].values), [0.0, 0.25])
+
+
+class Coalesce(unittest.TestCase):
+    def test_threads(self):
+        flights = SingleFlight()
+        calls = []
+
+        def slow(value):
+            calls.append(value)
+            time.sleep(0.2)
+            return value * 2
+
+        results = []
+        workers = [
+            threading.Thread(target=lambda: results.append(flights.do("a", slow, 2)))
+            for n in range(5)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(calls, [2])
+        self.assertEqual(results, [4] * 5)
+        self.assertEqual(flights.do("a", slow, 3), 6)
+
+    def test_async(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def slow(value):
+            calls.append(value)
+            await asyncio.sleep(0.1)
+            return value * 2
+
+        async def run():
+            return await asyncio.gather(
+                *[flights.do_async("a", slow, 2) for n in range(5)],
+                flights.do_async("b", slow, 3)
+            )
+
+        self.assertEqual(asyncio.run(run()), [4] * 5 + [6])
+        self.assertEqual(calls, [2, 3])
+
+    def test_async_cancel(self):
+        flights = SingleFlight()
+
+        async def slow():
+            await asyncio.sleep(0.1)
+            return 42
+
+        async def run():
+            first = asyncio.ensure_future(flights.do_async("a", slow))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(flights.do_async("a", slow))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            return await second, first.cancelled()
+
+        self.assertEqual(asyncio.run(run()), (42, True))
+        self.assertEqual(flights.async_calls, {})
+
+    def test_error(self):
+        flights = SingleFlight()
+
+        def fail():
+            raise RuntimeError("failed")
+
+        with self.assertRaises(RuntimeError):
+            flights.do("a", fail)
+        self.assertEqual(flights.calls, {})
+
+
+class Runs(unittest.TestCase):
+    def test_vectorised(self):
+        f = Forecast("0p25", "1hr")
+        probes = []
+
+        def check_avail(forecast_date, forecast_time):
+            probes.append(forecast_time)
+            return forecast_time != "12"
+
+        f.check_avail = check_avail
+        now = datetime.utcnow()
+        run = now.replace(hour=6 * (now.hour // 6), minute=0, second=0, microsecond=0)
+        times = np.array(
+            [run - timedelta(hours=h) for h in range(0, 48, 2)] * 10,
+            dtype="datetime64[s]",
+        )
+        dates, hours, indices = f.datetime_to_forecast(times)
+        self.assertEqual(len(indices), 240)
+        self.assertNotIn("12", hours)
+        self.assertEqual(indices[0], 0 if run.hour != 12 else 6)
+        self.assertLessEqual(len(probes), 12)
+        for n in [0, 5, 17]:
+            self.assertEqual(
+                (dates[n], hours[n], "[%s]" % indices[n]),
+                f.datetime_to_forecast(times[n].item()),
+            )
+
+    def test_unavailable(self):
+        f = Forecast("0p25", "1hr")
+        with self.assertRaises(ValueError):
+            f.datetime_to_forecast([datetime.utcnow() - timedelta(days=8)])
+
+
+def compressed_response(text, chunk_size=100):
+    """Makes a stand in for a streamed gzip compressed response"""
+    body = gzip.compress(text.encode())
+    chunks = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)]
+    r = mock.MagicMock(status_code=200, headers={"Content-Encoding": "gzip"})
+    r.raw.stream = lambda amount, decode_content: iter(chunks)
+    r.__enter__.return_value = r
+    return r
+
+
+class Compression(unittest.TestCase):
+    def test_lines(self):
+        r = compressed_response(example_file)
+        self.assertEqual(list(transport.iter_lines(r, "url")), example_file.splitlines())
+        self.assertEqual(r.transfer.uncompressed, len(example_file))
+        self.assertLess(r.transfer.compressed, len(example_file) / 3)
+        self.assertIs(transport.transfers[-1], r.transfer)
+
+    def test_download(self):
+        r = compressed_response(example_file)
+        with mock.patch.object(transport.requests, "get", return_value=r):
+            res = transport.download("url")
+        self.assertEqual(res.text, example_file)
+        self.assertIs(res.text, res.text)
+        self.assertGreater(res.transfer.ratio, 3)
+        self.assertFalse(transport.is_throttled(res))
+        res.content = b"<html>Over Rate Limit</html>"
+        self.assertTrue(transport.is_throttled(res))
+
+    def test_deflate(self):
+        for compress in [zlib.compressobj(), zlib.compressobj(wbits=-zlib.MAX_WBITS)]:
+            body = compress.compress(example_file.encode()) + compress.flush()
+            decompressor = transport.Decompressor("deflate")
+            data = b"".join(
+                decompressor.decompress(body[i : i + 50])
+                for i in range(0, len(body), 50)
+            )
+            self.assertEqual(data + decompressor.flush(), example_file.encode())
+
+
+class Aggregate(unittest.TestCase):
+    def run_example(self, variables=["hgtprs", "hgtmwl"], **kwargs):
+        f = Forecast("0p25", "1hr")
+
+        @contextmanager
+        def stream(url):
+            yield compressed_response(example_file)
+
+        request = {
+            "forecast_date": "20210227",
+            "forecast_time": "00",
+            "time": "[0:4]",
+            "lev": "[0:3]",
+            "lat": "[0:1]",
+            "lon": "[0:3]",
+            "variables": variables,
+            "query": "",
+        }
+        f.datetime_to_forecast = lambda date_time: ("20210227", "00", "[0]")
+        with mock.patch.object(aggregate, "stream", stream), mock.patch.object(
+            f, "prepare", return_value=request
+        ):
+            return f.aggregate(variables, "", "[-90:-89.75]", "[0:1]", **kwargs)
+
+    def test_statistics(self):
+        res = self.run_example(area_weighted=False, percentiles=[50])
+        data = example.variables["hgtprs"].data
+        self.assertEqual(res["hgtprs"]["mean"].shape, (5, 4))
+        np.testing.assert_allclose(res["hgtprs"]["mean"], data.mean(axis=(2, 3)))
+        np.testing.assert_allclose(res["hgtprs"]["std"], data.std(axis=(2, 3)))
+        np.testing.assert_allclose(res["hgtprs"]["max"], data.max(axis=(2, 3)))
+        np.testing.assert_allclose(
+            res["hgtprs"]["p50"], np.median(data, axis=(2, 3)), rtol=1e-3
+        )
+        self.assertEqual(res["hgtprs"]["count"][0, 0], 8)
+        self.assertEqual(res["hgtprs"]["lev"], [1000.0, 975.0, 950.0, 925.0])
+        self.assertEqual(res["hgtmwl"]["mean"][0], 9504.847)
+
+    def test_weights(self):
+        res = self.run_example()
+        data = example.variables["hgtprs"].data
+        weights = np.cos(np.radians([-90, -89.75]))[:, None] * np.ones((2, 4))
+        np.testing.assert_allclose(
+            res["hgtprs"]["mean"][1, 2], np.average(data[1, 2], weights=weights)
+        )
+
+    def test_polygon(self):
+        res = self.run_example(
+            ["hgtprs"],
+            area_weighted=False,
+            polygon=[(-89.8, -0.1), (-89.8, 0.3), (-89.7, 0.3), (-89.7, -0.1)],
+        )
+        data = example.variables["hgtprs"].data
+        self.assertEqual(res["hgtprs"]["count"][0, 0], 2)
+        self.assertEqual(res["hgtprs"]["mean"][0, 0], data[0, 0, 1, :2].mean())
+
+
+def fake_server(urls):
+    """Makes a stand in for fetch that answers data requests with value t * 1e6 + lat * 1e3 + lon"""
+
+    def fetch(address):
+        urls.append(address)
+        name, slabs = re.findall(r"ascii\?(\w+)(.*)", address)[0]
+        indices = []
+        for slab in re.findall(r"\[(.*?)\]", slabs):
+            parts = [int(p) for p in slab.split(":")]
+            if len(parts) == 3:
+                indices.append(list(range(parts[0], parts[2] + 1, parts[1])))
+            else:
+                indices.append(list(range(parts[0], parts[-1] + 1)))
+
+        def block(position):
+            if len(position) == len(indices) - 2:
+                return [
+                    "".join("[%s]" % p for p in position + [i])
+                    + ", "
+                    + ", ".join(
+                        str(
+                            indices[0][position[0]] * 1e6
+                            + indices[-2][i] * 1e3
+                            + indices[-1][j]
+                        )
+                        for j in range(len(indices[-1]))
+                    )
+                    for i in range(len(indices[-2]))
+                ]
+            lines = []
+            for i in range(len(indices[len(position)])):
+                lines += block(position + [i]) + [""]
+            return lines
+
+        lines = [name + ", " + "".join("[%s]" % len(i) for i in indices)]
+        lines += block([]) + [""]
+        dims = (
+            ["time", "lev", "lat", "lon"]
+            if len(indices) == 4
+            else ["time", "lat", "lon"]
+        )
+        for dim, ind in zip(dims, indices):
+            lines += [
+                "%s, [%s]" % (dim, len(ind)),
+                ", ".join(str(float(i)) for i in ind),
+            ]
+        return mock.Mock(status_code=200, text="\n".join(lines))
+
+    return fetch
+
+
+class Remote(unittest.TestCase):
+    def test_slices(self):
+        urls = []
+        f = Forecast("0p25", "1hr")
+        with mock.patch.object(remote, "fetch", fake_server(urls)):
+            var = remote.RemoteVariable(
+                f, "tmp2m", "20210227", "00", {"lat": 10, "lon": 10}
+            )
+            self.assertEqual(var.shape, (121, 721, 1440))
+            data = var[0, 400:405, 10:15]
+            self.assertEqual(data.shape, (5, 5))
+            self.assertEqual(data[1, 2], 401 * 1e3 + 12)
+            self.assertEqual(var[0, 402, 12:14].tolist(), [402012.0, 402013.0])
+            self.assertEqual(len(urls), 1)
+            self.assertIn("tmp2m[0:0][400:409][10:19]", urls[0])
+
+            strided = var[1, 400:420:4, 0:3]
+            self.assertIn("[400:4:419]", urls[-1])
+            self.assertEqual(
+                strided[:, 0].tolist(), [1e6 + i * 1e3 for i in range(400, 420, 4)]
+            )
+
+    def test_loc(self):
+        urls = []
+        f = Forecast("0p25", "1hr")
+        with mock.patch.object(remote, "fetch", fake_server(urls)):
+            var = remote.RemoteVariable(f, "tmp2m", "20210227", "00")
+            data = var.loc["20210227 03:00", 10:11, -1:-0.5]
+            self.assertEqual(data.shape, (5, 3))
+            self.assertEqual(data[0, 0], 3e6 + 400e3 + 1436)
+            self.assertEqual(
+                var.loc["20210227 03:00", 10, 0:1:0.5].tolist(),
+                [3400000.0, 3400002.0, 3400004.0],
+            )
+            self.assertEqual(len(urls), 2)
+
+    def test_loc_invalid(self):
+        urls = []
+        f = Forecast("0p25", "1hr")
+        with mock.patch.object(remote, "fetch", fake_server(urls)):
+            var = remote.RemoteVariable(f, "tmp2m", "20210227", "00")
+            with self.assertRaises(IndexError):
+                var.loc["20210227 03:00", 10, -10:10]
+            with self.assertRaises(IndexError):
+                var.loc["20220101", 10, 0]
+            with self.assertRaises(IndexError):
+                var.loc["20210226 12:00", 10, 0]
+            self.assertEqual(var.loc["20210227 03:00", 10, -180:180:90].shape, (4,))
+            self.assertEqual(len(urls), 1)
+
+
+class FakeSession:
+    """Enough of aiohttp.ClientSession to serve one gzip compressed body"""
+
+    def __init__(self, text):
+        self.body = gzip.compress(text.encode())
+        self.urls = []
+
+    def get(self, url, headers=None, auto_decompress=True):
+        self.urls.append(url)
+        session = self
+
+        class Content:
+            async def iter_chunked(self, size):
+                for i in range(0, len(session.body), size):
+                    await asyncio.sleep(0.01)
+                    yield session.body[i : i + size]
+
+        class Response:
+            status = 200
+            headers = {"Content-Encoding": "gzip"}
+            content = Content()
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                pass
+
+        return Response()
+
+
+class Async(unittest.TestCase):
+    def test_fetch(self):
+        session = FakeSession(example_file)
+
+        async def run():
+            return await asyncio.gather(
+                *[transport.fetch_async(session, "url") for n in range(10)]
+            )
+
+        responses = asyncio.run(run())
+        self.assertEqual(len(session.urls), 1)
+        self.assertTrue(all(r.text == example_file for r in responses))
+        self.assertEqual(responses[0].transfer.uncompressed, len(example_file))
+        self.assertEqual(responses[0].transfer.compressed, len(session.body))
+
+    def test_slots(self):
+        limiter = RateLimiter(rate=1000, burst=1000, max_in_flight=3)
+        order = []
+        active = []
+
+        async def request(n):
+            slot = await limiter.acquire_slot_async()
+            try:
+                order.append(n)
+                active.append(n)
+                self.assertLessEqual(len(active), 3)
+                await asyncio.sleep(0.01)
+                active.remove(n)
+            finally:
+                limiter.release_slot_async(slot)
+
+        async def run():
+            await asyncio.gather(*[request(n) for n in range(50)])
+
+        asyncio.run(run())
+        self.assertEqual(order, list(range(50)))
+        # Everything is given back for threads and other event loops
+        for n in range(3):
+            self.assertTrue(limiter.slots.acquire(blocking=False))
+
+    def test_get(self):
+        urls = []
+
+        async def fetch_async(session, url):
+            urls.append(url)
+            await asyncio.sleep(0.01)
+            text = "gustsfc" if "gustsfc" in url else example_file
+            return transport.Response(
+                200, {}, text.encode(), transport.Transfer(url, "")
+            )
+
+        now = datetime.utcnow()
+        run = now.replace(hour=6 * (now.hour // 6), minute=0, second=0, microsecond=0)
+
+        async def run_gets():
+            async with aio.AsyncForecast("0p25", "1hr") as f:
+                return await asyncio.gather(
+                    *[
+                        f.get(["hgtprs"], run + timedelta(hours=n), "[0:1]", "[0:3]")
+                        for n in range(5)
+                    ]
+                ), await f.datetime_to_forecast(run)
+
+        with mock.patch.object(aio, "fetch_async", fetch_async):
+            results, forecast = asyncio.run(run_gets())
+        self.assertEqual(forecast, (run.strftime("%Y%m%d"), run.strftime("%H"), "[0]"))
+        self.assertEqual(results[2].variables["hgtprs"].data.shape, (5, 4, 2, 4))
+        queries = [u for u in urls if "hgtprs" in u]
+        self.assertEqual(len(queries), 5)
+        self.assertTrue(any("hgtprs[3][0:40]" in u for u in queries))
+        self.assertFalse(hasattr(aio.AsyncForecast("0p25", "1hr"), "variable"))
+
+    def test_load_cancelled(self):
+        f = aio.AsyncForecast("1p00")
+        path = gfs_module.attribute_lock.format(res="1p00", step="")
+
+        async def run():
+            with mock.patch.object(aio, "load_attributes", return_value=None):
+                with FileLock(path):
+                    task = asyncio.ensure_future(f.load())
+                    await asyncio.sleep(0.1)
+                    task.cancel()
+                    await asyncio.sleep(0.1)
+            return task.cancelled()
+
+        self.assertTrue(asyncio.run(run()))
+        lock = FileLock(path)
+        self.assertTrue(lock.acquire(blocking=False))
+        lock.release()
+
+    def test_prepare(self):
+        f = asyncio.run(aio.AsyncForecast.create("0p25", "1hr"))
+        request = f.prepare(["tmp2m"], "20210227", 10, 0, ("20210227", "00", "[0]"))
+        self.assertEqual(request["query"], "tmp2m[0][400][0]")
+
+
 if __name__ == "__main__":
     unittest.main()
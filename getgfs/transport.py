@@ -0,0 +1,626 @@
+"""Sends the requests to NOMADS, keeping to a rate limit and a maximum number of requests in flight
+
+All of the requests made by getgfs go through `fetch` so that running many queries in parallel
+(threads or processes) doesn't get the IP temporarily blocked by NOMADS, which is much slower than
+just going at a sustainable rate. Identical requests made at the same time are only sent once.
+The limits can be changed with `configure`, for example::
+
+    getgfs.transport.configure(rate=1, max_in_flight=2, lock_file="/tmp/getgfs.lock")
+
+`fetch_async` is the same for coroutines, making the requests with an aiohttp session so that lots of
+requests can wait on one event loop without threads. It shares the rate limiter with `fetch`.
+
+Responses are requested gzip or deflate compressed (the ASCII responses compress very well) and
+decompressed as they arrive. The compressed and uncompressed size of each response is recorded in
+`transfers` and on the response (and File objects from Forecast.get) as `transfer`.
+"""
+import asyncio, json, threading, time, weakref, zlib
+from collections import deque
+from contextlib import contextmanager
+import requests
+from .locking import FileLock
+from .singleflight import SingleFlight
+
+__copyright__ = """
+    getgfs - a library for extracting weather forecast variables from the NOAA GFS forecast in a pure python, no obscure dependencies way
+    Copyright (C) 2021 Jago Strong-Wright
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>."""
+
+throttle_codes = [429, 503]
+headers = {"Accept-Encoding": "gzip, deflate"}
+transfers = deque(maxlen=1000)
+
+
+class RateLimiter:
+    """Token bucket rate limiter with a cap on the number of requests in flight
+
+    The rate is adaptive: it halves every time a throttling response is seen and creeps back up
+    towards the configured rate with each successful request.
+    """
+
+    def __init__(
+        self, rate=2.0, burst=5, max_in_flight=4, lock_file=None, min_rate=0.05
+    ):
+        """Create the limiter
+
+        Args:
+            rate (float, optional): Maximum requests per second. Defaults to 2.0.
+            burst (int, optional): Number of requests that can be made at once after being idle. Defaults to 5.
+            max_in_flight (int, optional): Maximum number of requests open at once. Defaults to 4.
+            lock_file (str, optional): File to share the limits between processes, only shared within the process if None. Defaults to None.
+            min_rate (float, optional): The lowest the rate will be adapted down to. Defaults to 0.05.
+        """
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.burst = max(1, int(burst))
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.lock_file = lock_file
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.max_in_flight)
+        self.async_slots = weakref.WeakKeyDictionary()
+
+    def _update(self, state, now, take=False, scale=None):
+        """Refills the bucket and optionally takes a token or changes the rate
+
+        Args:
+            state (dict): Bucket state with tokens, updated and rate
+            now (float): Current time
+            take (bool, optional): Try to take a token. Defaults to False.
+            scale (float, optional): Multiply the rate by this, None for an additive increase after a success. Defaults to None.
+
+        Returns:
+            float: Seconds to wait before a token is available (0 if one was taken)
+        """
+        state["tokens"] = min(
+            self.burst,
+            state["tokens"] + max(0, now - state["updated"]) * state["rate"],
+        )
+        state["updated"] = now
+        if take:
+            if state["tokens"] >= 1:
+                state["tokens"] -= 1
+                return 0
+            return (1 - state["tokens"]) / state["rate"]
+        if scale is None:
+            state["rate"] = min(self.max_rate, state["rate"] + 0.05 * self.max_rate)
+        else:
+            state["rate"] = min(
+                self.max_rate, max(self.min_rate, state["rate"] * scale)
+            )
+            state["tokens"] = min(state["tokens"], 0)
+        return 0
+
+    def _with_state(self, **kwargs):
+        """Runs _update on the shared state, from the lock file if one is set
+
+        Returns:
+            float: Result of _update
+        """
+        now = time.time()
+        with self.lock:
+            if self.lock_file is None:
+                state = {
+                    "tokens": self.tokens,
+                    "updated": self.updated,
+                    "rate": self.rate,
+                }
+                wait = self._update(state, now, **kwargs)
+            else:
+                with FileLock(self.lock_file) as lock:
+                    try:
+                        state = json.loads(lock.read())
+                    except ValueError:
+                        state = {
+                            "tokens": float(self.burst),
+                            "updated": now,
+                            "rate": self.max_rate,
+                        }
+                    wait = self._update(state, now, **kwargs)
+                    lock.write(json.dumps(state))
+            self.tokens, self.updated, self.rate = (
+                state["tokens"],
+                state["updated"],
+                state["rate"],
+            )
+        return wait
+
+    def wait(self):
+        """Blocks until the rate limit allows another request"""
+        while True:
+            delay = self._with_state(take=True)
+            if delay == 0:
+                return
+            time.sleep(delay)
+
+    async def wait_async(self):
+        """Waits without blocking the event loop until the rate limit allows another request"""
+        while True:
+            delay = self._with_state(take=True)
+            if delay == 0:
+                return
+            await asyncio.sleep(delay)
+
+    def acquire_slot(self):
+        """Blocks until a request can be opened without going over max_in_flight
+
+        Returns:
+            FileLock: The process shared slot if a lock file is set, otherwise None
+        """
+        self.slots.acquire()
+        if self.lock_file is None:
+            return None
+        try:
+            while True:
+                for n in range(self.max_in_flight):
+                    slot = FileLock("%s.%d" % (self.lock_file, n))
+                    if slot.acquire(blocking=False):
+                        return slot
+                time.sleep(0.05)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def async_queue(self):
+        """The semaphore that coroutines on the running event loop queue on for a slot
+
+        Returns:
+            asyncio.Semaphore: Semaphore with max_in_flight places
+        """
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if loop not in self.async_slots:
+                self.async_slots[loop] = asyncio.Semaphore(self.max_in_flight)
+            return self.async_slots[loop]
+
+    async def acquire_slot_async(self, poll=0.05):
+        """Waits without blocking the event loop until a request can be opened, see acquire_slot
+
+        Note
+        ----
+        Coroutines wait in turn on an asyncio semaphore, so however many are waiting at most max_in_flight
+        of them (per event loop) poll the slots shared with threads and other processes
+
+        Args:
+            poll (float, optional): Seconds between attempts when all the shared slots are taken. Defaults to 0.05.
+
+        Returns:
+            FileLock: The process shared slot if a lock file is set, otherwise None (free it with release_slot_async)
+        """
+        queue = self.async_queue()
+        await queue.acquire()
+        try:
+            while not self.slots.acquire(blocking=False):
+                await asyncio.sleep(poll)
+            if self.lock_file is None:
+                return None
+            try:
+                while True:
+                    for n in range(self.max_in_flight):
+                        slot = FileLock("%s.%d" % (self.lock_file, n))
+                        if slot.acquire(blocking=False):
+                            return slot
+                    await asyncio.sleep(poll)
+            except BaseException:
+                self.slots.release()
+                raise
+        except BaseException:
+            queue.release()
+            raise
+
+    def release_slot_async(self, slot):
+        """Frees a slot taken by acquire_slot_async, on the same event loop
+
+        Args:
+            slot (FileLock): Value returned by acquire_slot_async
+        """
+        self.release_slot(slot)
+        self.async_queue().release()
+
+    def release_slot(self, slot):
+        """Frees a slot taken by acquire_slot
+
+        Args:
+            slot (FileLock): Value returned by acquire_slot
+        """
+        if slot is not None:
+            slot.release()
+        self.slots.release()
+
+    def throttled(self):
+        """Record a throttling response, halving the rate"""
+        self._with_state(scale=0.5)
+
+    def succeeded(self):
+        """Record a successful response, increasing the rate back towards the maximum"""
+        self._with_state()
+
+
+class Transfer:
+    """Size and timing of a response"""
+
+    def __init__(self, url, encoding):
+        """Start recording a transfer
+
+        Args:
+            url (str): Address requested
+            encoding (str): Content encoding of the response ("" if uncompressed)
+        """
+        self.url = url
+        self.encoding = encoding
+        self.compressed = 0
+        self.uncompressed = 0
+        self.start = time.monotonic()
+        self.seconds = None
+
+    @property
+    def ratio(self):
+        """Uncompressed size over the size that was transferred"""
+        return self.uncompressed / self.compressed if self.compressed > 0 else 1.0
+
+    def __str__(self):
+        return "%s bytes transferred (%s uncompressed, %s) in %.2fs" % (
+            self.compressed,
+            self.uncompressed,
+            self.encoding or "identity",
+            self.seconds or 0,
+        )
+
+
+class Response:
+    """A fully read response"""
+
+    def __init__(self, status_code, headers, content, transfer):
+        """Create response
+
+        Args:
+            status_code (int): HTTP status
+            headers (dict): Response headers
+            content (bytes): Uncompressed body
+            transfer (Transfer): Size and timing of the response
+        """
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.transfer = transfer
+        self._text = None
+
+    @property
+    def text(self):
+        """Body as a string, decoded the first time it is used"""
+        if self._text is None:
+            self._text = self.content.decode("utf-8", errors="replace")
+        return self._text
+
+
+class Decompressor:
+    """Incremental gzip/deflate decompression"""
+
+    def __init__(self, encoding):
+        """Create decompressor
+
+        Args:
+            encoding (str): Content encoding, anything other than gzip or deflate is passed through
+        """
+        self.encoding = encoding
+        self.started = False
+        if encoding in ["gzip", "x-gzip", "deflate"]:
+            # 32 + MAX_WBITS detects either a gzip or zlib header
+            self.decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        else:
+            self.decompressor = None
+
+    def decompress(self, chunk):
+        """Decompress the next chunk of the body
+
+        Args:
+            chunk (bytes): Compressed data
+
+        Returns:
+            bytes: Uncompressed data
+        """
+        if self.decompressor is None:
+            return chunk
+        try:
+            data = self.decompressor.decompress(chunk)
+        except zlib.error:
+            if self.started or self.encoding != "deflate":
+                raise
+            # Some servers send deflate without the zlib header
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = self.decompressor.decompress(chunk)
+        self.started = True
+        return data
+
+    def flush(self):
+        """Returns any data left in the decompressor
+
+        Returns:
+            bytes: Uncompressed data
+        """
+        if self.decompressor is None:
+            return b""
+        return self.decompressor.flush()
+
+
+def read_chunks(r, url, chunk_size=65536):
+    """Reads and decompresses the body of a streamed response as it arrives, recording its size
+
+    Args:
+        r (requests.Response): Response opened with stream=True
+        url (str): Address requested
+        chunk_size (int, optional): Bytes to read at a time. Defaults to 65536.
+
+    Yields:
+        bytes: Uncompressed data
+    """
+    encoding = r.headers.get("Content-Encoding", "").lower()
+    transfer = Transfer(url, encoding)
+    r.transfer = transfer
+    decompressor = Decompressor(encoding)
+    for chunk in r.raw.stream(chunk_size, decode_content=False):
+        transfer.compressed += len(chunk)
+        data = decompressor.decompress(chunk)
+        transfer.uncompressed += len(data)
+        yield data
+    data = decompressor.flush()
+    transfer.uncompressed += len(data)
+    transfer.seconds = time.monotonic() - transfer.start
+    transfers.append(transfer)
+    yield data
+
+
+def iter_lines(r, url):
+    """Reads the lines of a streamed response as they arrive
+
+    Args:
+        r (requests.Response): Response opened with stream=True
+        url (str): Address requested
+
+    Yields:
+        str: Lines without line endings
+    """
+    pending = b""
+    for data in read_chunks(r, url):
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip(b"\r").decode("utf-8", errors="replace")
+    if len(pending) > 0:
+        yield pending.rstrip(b"\r").decode("utf-8", errors="replace")
+
+
+def download(url):
+    """Downloads a url, decompressing it as it arrives
+
+    Args:
+        url (str): Address to get
+
+    Returns:
+        Response: The response
+    """
+    with requests.get(url, headers=headers, stream=True) as r:
+        content = b"".join(read_chunks(r, url))
+        return Response(r.status_code, r.headers, content, r.transfer)
+
+
+async def download_async(session, url, chunk_size=65536):
+    """Downloads a url with an aiohttp session, decompressing it as it arrives
+
+    Args:
+        session (aiohttp.ClientSession): Session to make the request with
+        url (str): Address to get
+        chunk_size (int, optional): Bytes to read at a time. Defaults to 65536.
+
+    Returns:
+        Response: The response
+    """
+    async with session.get(url, headers=headers, auto_decompress=False) as r:
+        encoding = r.headers.get("Content-Encoding", "").lower()
+        transfer = Transfer(url, encoding)
+        decompressor = Decompressor(encoding)
+        content = []
+        async for chunk in r.content.iter_chunked(chunk_size):
+            transfer.compressed += len(chunk)
+            content.append(decompressor.decompress(chunk))
+        content.append(decompressor.flush())
+        content = b"".join(content)
+        transfer.uncompressed = len(content)
+        transfer.seconds = time.monotonic() - transfer.start
+        transfers.append(transfer)
+        return Response(r.status, r.headers, content, transfer)
+
+
+def summary():
+    """Totals for the recent transfers
+
+    Returns:
+        dict: Number of requests and total compressed and uncompressed bytes
+    """
+    recent = list(transfers)
+    return {
+        "requests": len(recent),
+        "compressed": sum(t.compressed for t in recent),
+        "uncompressed": sum(t.uncompressed for t in recent),
+    }
+
+
+limiter = RateLimiter()
+flights = SingleFlight()
+
+
+def configure(**kwargs):
+    """Replaces the shared rate limiter, see RateLimiter for the options
+
+    Returns:
+        RateLimiter: The new limiter
+    """
+    global limiter
+    limiter = RateLimiter(**kwargs)
+    return limiter
+
+
+def is_throttled(r):
+    """Works out if a response means NOMADS is limiting our requests
+
+    Args:
+        r (Response): Response to check
+
+    Returns:
+        bool: True if the request was throttled
+    """
+    if r.status_code in throttle_codes:
+        return True
+    # Only the start of the body is checked so large responses aren't decoded here
+    return r.status_code == 200 and b"over rate limit" in r.content[:1000].lower()
+
+
+def fetch(url, retries=3):
+    """Gets a url through the shared rate limiter, retrying if the request is throttled
+
+    Note
+    ----
+    If the same url is already being downloaded by another thread this waits for and returns
+    that response rather than making a second request
+
+    Args:
+        url (str): Address to get
+        retries (int, optional): Number of times to retry a throttled request. Defaults to 3.
+
+    Returns:
+        Response: The response
+    """
+    return flights.do(url, fetch_limited, url, retries)
+
+
+def fetch_limited(url, retries=3):
+    """Gets a url through the shared rate limiter without coalescing identical requests
+
+    Args:
+        url (str): Address to get
+        retries (int, optional): Number of times to retry a throttled request. Defaults to 3.
+
+    Returns:
+        Response: The response
+    """
+    rate_limiter = limiter
+    for attempt in range(retries + 1):
+        rate_limiter.wait()
+        slot = rate_limiter.acquire_slot()
+        try:
+            r = download(url)
+        finally:
+            rate_limiter.release_slot(slot)
+        if not is_throttled(r):
+            rate_limiter.succeeded()
+            return r
+        rate_limiter.throttled()
+        if attempt < retries:
+            try:
+                time.sleep(float(r.headers.get("Retry-After", 0)))
+            except ValueError:
+                pass
+    return r
+
+
+async def fetch_async(session, url, retries=3):
+    """Awaitable version of fetch, making the request with an aiohttp session
+
+    Note
+    ----
+    Identical requests made at the same time on the same event loop are only sent once
+
+    Args:
+        session (aiohttp.ClientSession): Session to make the request with
+        url (str): Address to get
+        retries (int, optional): Number of times to retry a throttled request. Defaults to 3.
+
+    Returns:
+        Response: The response
+    """
+    return await flights.do_async(url, fetch_limited_async, session, url, retries)
+
+
+async def fetch_limited_async(session, url, retries=3):
+    """Awaitable version of fetch_limited
+
+    Args:
+        session (aiohttp.ClientSession): Session to make the request with
+        url (str): Address to get
+        retries (int, optional): Number of times to retry a throttled request. Defaults to 3.
+
+    Returns:
+        Response: The response
+    """
+    rate_limiter = limiter
+    for attempt in range(retries + 1):
+        # The slot is taken first so only the coroutines with one wait on the rate limit
+        slot = await rate_limiter.acquire_slot_async()
+        try:
+            await rate_limiter.wait_async()
+            r = await download_async(session, url)
+        finally:
+            rate_limiter.release_slot_async(slot)
+        if not is_throttled(r):
+            rate_limiter.succeeded()
+            return r
+        rate_limiter.throttled()
+        if attempt < retries:
+            try:
+                await asyncio.sleep(float(r.headers.get("Retry-After", 0)))
+            except ValueError:
+                pass
+    return r
+
+
+@contextmanager
+def stream(url, retries=3):
+    """Opens a url through the shared rate limiter without downloading the body so it can be read as it arrives
+
+    Note
+    ----
+    The request counts as in flight until the context is left. Identical requests are not coalesced
+    since the body can only be read once
+
+    Args:
+        url (str): Address to get
+        retries (int, optional): Number of times to retry a throttled request. Defaults to 3.
+
+    Yields:
+        requests.Response: The response, with the body still to be read (use iter_lines or read_chunks to decompress it)
+    """
+    rate_limiter = limiter
+    for attempt in range(retries + 1):
+        rate_limiter.wait()
+        slot = rate_limiter.acquire_slot()
+        try:
+            r = requests.get(url, headers=headers, stream=True)
+            if r.status_code in throttle_codes:
+                rate_limiter.throttled()
+            else:
+                rate_limiter.succeeded()
+            if r.status_code not in throttle_codes or attempt == retries:
+                with r:
+                    yield r
+                return
+            r.close()
+        finally:
+            rate_limiter.release_slot(slot)
+        try:
+            time.sleep(float(r.headers.get("Retry-After", 0)))
+        except ValueError:
+            pass
@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     # Application name:
@@ -15,6 +15,8 @@ setup(
     #
     license="LICENSE.txt",
     description="getgfs extracts weather forecast variables from the NOAA GFS forecast",
+    # Command line tools
+    entry_points={"console_scripts": ["getgfs=getgfs.cli:main"]},
     # Dependent packages (distributions)
     install_requires=[
         "scipy",
@@ -24,6 +26,8 @@ setup(
         "python_dateutil",
         "regex",
     ],
+    # Optional dependencies
+    extras_require={"async": ["aiohttp"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",